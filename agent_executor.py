@@ -0,0 +1,46 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_QUEUE_DEPTH = 64
+
+
+class BoundedExecutor:
+    # ThreadPoolExecutor with a cap on queued work: submit() blocks once
+    # max_workers tasks are running and queue_depth more are waiting
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH):
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self._slots = threading.BoundedSemaphore(max_workers + queue_depth)
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("Agent executor queue is full")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_agent_executor():
+    # Process-wide pool shared by every Streamlit session
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = BoundedExecutor(
+                max_workers=int(os.getenv("AGENT_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+                queue_depth=int(os.getenv("AGENT_QUEUE_DEPTH", DEFAULT_QUEUE_DEPTH)),
+            )
+        return _executor
@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from engine import (
+    BATCH_CONCURRENCY,
+    PIPELINE_MODE,
+    PIPELINE_MODES,
+    analysis_complete,
+    process_exception_async,
+    read_exception_records,
+)
+from local_classifier import get_fast_path
+from metrics import get_metrics
+from rate_limiter import get_rate_limiter
+
+logger = logging.getLogger("batch")
+
+
+def _completed_indexes(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn last line from an interrupted run
+                continue
+            if record.get("ok"):
+                done.add(record["index"])
+    return done
+
+
+def _open_output(path, resume):
+    if not resume or not os.path.exists(path):
+        return open(path, "w", encoding="utf-8")
+    outfile = open(path, "a+", encoding="utf-8")
+    if outfile.tell():
+        outfile.seek(outfile.tell() - 1)
+        if outfile.read(1) != "\n":
+            outfile.write("\n")
+    return outfile
+
+
+async def _process(index, exception_details, mode):
+    # One record's failure is written as a failed record rather than ending the run
+    try:
+        results = await process_exception_async(exception_details, mode=mode)
+    except Exception as e:
+        logger.exception("Record %d failed", index)
+        return {
+            "index": index,
+            "exception_details": exception_details,
+            "ok": False,
+            "error": f"{type(e).__name__}: {e}",
+            "results": {},
+        }
+    return {
+        "index": index,
+        "exception_details": exception_details,
+        "ok": analysis_complete(results),
+        "results": results,
+    }
+
+
+async def run_batch(input_path, output_path, concurrency=BATCH_CONCURRENCY, mode=None, resume=True):
+    # Streams input records, keeps `concurrency` exceptions in flight and appends each
+    # result as soon as it completes. Failed records are written with "ok": false and
+    # retried on the next resumed run, so consumers should keep the last line per index.
+    done = _completed_indexes(output_path) if resume else set()
+    if done:
+        logger.info("Resuming: %d records already completed", len(done))
+    processed = failed = 0
+    started = time.perf_counter()
+
+    def write(record):
+        nonlocal processed, failed
+        outfile.write(json.dumps(record) + "\n")
+        outfile.flush()
+        processed += 1
+        failed += not record["ok"]
+        if processed % 100 == 0:
+            rate = processed / (time.perf_counter() - started) * 60
+            quota = ", ".join(
+                f"{model} {usage['rpm']:.0%} RPM / {usage['tpm']:.0%} TPM"
+                for model, usage in get_rate_limiter().utilization().items()
+            )
+            logger.info("%d processed (%d failed), %.1f exceptions/min, quota: %s", processed, failed, rate, quota)
+
+    with open(input_path, encoding="utf-8-sig", newline="") as infile, _open_output(output_path, resume) as outfile:
+        pending = set()
+        for index, exception_details in enumerate(read_exception_records(infile, input_path)):
+            if index in done:
+                continue
+            if len(pending) >= concurrency:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    write(task.result())
+            pending.add(asyncio.ensure_future(_process(index, exception_details, mode)))
+        for task in asyncio.as_completed(pending):
+            write(await task)
+
+    elapsed = time.perf_counter() - started
+    logger.info("Done: %d processed (%d failed, %d skipped) in %.1fs", processed, failed, len(done), elapsed)
+    fast_path = get_fast_path()
+    if fast_path is not None and fast_path.stats()["escalation_rate"] is not None:
+        stats = fast_path.stats()
+        logger.info("Local classifier: %d answered locally, %d escalated (%.0f%% escalation rate)",
+                    stats["local"], stats["escalated"], stats["escalation_rate"] * 100)
+    for entry in get_metrics().stats():
+        logger.info("Agent %s on %s%s: %d calls (%d errors, %d retries), p50 %.2fs, p95 %.2fs, %d+%d tokens, $%.4f",
+                    entry["agent"], entry["model"], f" ({entry['route']} route)" if entry["route"] else "",
+                    entry["calls"], entry["errors"], entry["retries"],
+                    entry["p50_seconds"], entry["p95_seconds"], entry["prompt_tokens"],
+                    entry["completion_tokens"], entry["cost"])
+    return processed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process a CSV, JSONL or JSON file of exceptions without the Streamlit UI.")
+    parser.add_argument("input", help="CSV, JSONL or JSON array file of exceptions")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="exceptions in flight at once")
+    parser.add_argument("--mode", choices=PIPELINE_MODES, default=PIPELINE_MODE)
+    parser.add_argument("--restart", action="store_true", help="overwrite the output instead of resuming from it")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    _, failed = asyncio.run(
+        run_batch(args.input, args.output, concurrency=args.concurrency, mode=args.mode, resume=not args.restart)
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
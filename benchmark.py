@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from metrics import get_metrics
+
+# Templates for synthetic exceptions; ids and amounts vary so no two requests share a cache entry
+TEMPLATES = (
+    "NAV break for fund {fund}: price for ISIN US{isin} differs from the vendor feed by {pct}%",
+    "Cash reconciliation break on account {account}: custodian balance {amount} USD vs ledger {other} USD",
+    "Trade {trade} for fund {fund} failed to settle: counterparty SSI mismatch on {date}",
+    "Corporate action {trade} on ISIN US{isin}: dividend rate {pct} not booked for fund {fund}",
+    "Position break for fund {fund}: {amount} shares of ISIN US{isin} missing from the custodian file",
+)
+# Settings the benchmark applies unless already set in the environment: measure the
+# uncached pipeline, and keep the client-side limiter from throttling the mock
+BENCHMARK_ENV = {
+    "RESULT_CACHE_ENABLED": "0",
+    "SEMANTIC_CACHE_ENABLED": "0",
+    "CASE_HISTORY_ENABLED": "0",
+    "LOCAL_CLASSIFIER_ENABLED": "0",
+    "OPENAI_RPM_LIMIT": "1000000",
+    "OPENAI_TPM_LIMIT": "1000000000",
+    "OPENAI_API_KEY": "benchmark",
+}
+
+
+def exceptions(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        rng.choice(TEMPLATES).format(
+            fund=f"F{rng.randrange(10000):04d}", isin=f"{rng.randrange(10 ** 10):010d}",
+            pct=f"{rng.uniform(0.1, 9.9):.2f}", account=rng.randrange(10 ** 8),
+            amount=f"{rng.uniform(1e3, 1e7):.2f}", other=f"{rng.uniform(1e3, 1e7):.2f}",
+            trade=f"T{rng.randrange(10 ** 9)}", date=f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+        )
+        for _ in range(count)
+    ]
+
+
+def start_mock(args):
+    # The stand-in runs in its own process so its CPU, threads and memory stay out of the numbers
+    command = [
+        sys.executable, "-m", "mock_openai", "--port", "0", "--latency-ms", str(args.latency_ms),
+        "--sigma", str(args.sigma), "--token-ms", str(args.token_ms), "--error-rate", str(args.error_rate),
+        "--seed", "0",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    line = process.stdout.readline()
+    if not line.startswith("Mock OpenAI API on "):
+        process.kill()
+        raise RuntimeError(f"Mock server failed to start: {line!r}")
+    return process, line.split()[4]
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+class Sampler:
+    # Polls thread count and resident memory while a run is in flight
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.threads = []
+        self.rss = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.threads.append(threading.active_count())
+            self.rss.append(rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _timed(engine, exception_details, mode):
+    started = time.perf_counter()
+    results = engine.process_exception(exception_details, mode=mode, on_error=lambda message: None)
+    return time.perf_counter() - started, engine.analysis_complete(results)
+
+
+async def _timed_async(engine, exception_details, mode, semaphore):
+    async with semaphore:
+        started = time.perf_counter()
+        results = await engine.process_exception_async(exception_details, mode=mode)
+        return time.perf_counter() - started, engine.analysis_complete(results)
+
+
+async def _run_async(engine, texts, mode, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(_timed_async(engine, text, mode, semaphore) for text in texts))
+
+
+def run(engine, texts, mode, concurrency, path):
+    # path "sync" drives process_exception from a thread per operator (the UI),
+    # "async" drives process_exception_async on one event loop (the batch CLI)
+    registry = get_metrics()
+    registry.reset()
+    rss_before = rss_mb()
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    with Sampler() as sampler:
+        if path == "async":
+            outcomes = asyncio.run(_run_async(engine, texts, mode, concurrency))
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(lambda text: _timed(engine, text, mode), texts))
+    elapsed = time.perf_counter() - started
+    latencies = np.array([seconds for seconds, _ in outcomes]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "mode": mode,
+        "path": path,
+        "concurrency": concurrency,
+        "requests": len(texts),
+        "failures": sum(not ok for _, ok in outcomes),
+        "latency_ms": {
+            "p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2),
+            "mean": round(float(latencies.mean()), 2), "max": round(float(latencies.max()), 2),
+        },
+        "throughput_per_s": round(len(texts) / elapsed, 3),
+        "cpu_ms_per_request": round((time.process_time() - cpu_started) / len(texts) * 1000, 3),
+        "threads_peak": max(sampler.threads, default=threading.active_count()),
+        "rss_mb": {"before": round(rss_before, 1), "peak": round(max(sampler.rss, default=rss_before), 1),
+                   "after": round(rss_mb(), 1)},
+        "agents": registry.stats(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline, tolerance):
+    # Prints the change against a previous report; returns the runs whose p95 or
+    # throughput regressed by more than tolerance
+    previous = {(run["mode"], run["path"], run["concurrency"]): run for run in baseline["runs"]}
+    regressions = []
+    for current in report["runs"]:
+        key = (current["mode"], current["path"], current["concurrency"])
+        if key not in previous:
+            continue
+        old = previous[key]
+        p95 = current["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1
+        throughput = current["throughput_per_s"] / old["throughput_per_s"] - 1
+        print(f"{key[0]:<6} {key[1]:<5} c={key[2]:<4} p95 {p95:+.1%}  throughput {throughput:+.1%}")
+        if p95 > tolerance or throughput < -tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark process_exception against the local OpenAI stand-in.")
+    parser.add_argument("--requests", type=int, default=100, help="exceptions per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--mode", nargs="+", default=["agents"], choices=["agents", "fused"])
+    parser.add_argument("--path", nargs="+", default=["sync"], choices=["sync", "async"])
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="median mock response latency")
+    parser.add_argument("--sigma", type=float, default=0.3, help="lognormal spread of the mock latency")
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--base-url", help="use an already running stand-in instead of starting one")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed p95 / throughput regression")
+    args = parser.parse_args(argv)
+
+    for name, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(name, value)
+    mock = None
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    else:
+        mock, os.environ["OPENAI_BASE_URL"] = start_mock(args)
+    try:
+        # Imported late: the clients read OPENAI_BASE_URL when the module loads
+        import engine
+
+        texts = exceptions(args.requests * len(args.concurrency) * len(args.mode) * len(args.path) + 4)
+        for text in texts[:4]:
+            engine.process_exception(text, on_error=lambda message: None)
+        texts = texts[4:]
+        report = {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "mock": {"base_url": os.environ["OPENAI_BASE_URL"], "latency_ms": args.latency_ms,
+                         "sigma": args.sigma, "token_ms": args.token_ms, "error_rate": args.error_rate},
+                "env": {name: os.environ[name] for name in sorted(BENCHMARK_ENV) if name != "OPENAI_API_KEY"},
+            },
+            "runs": [],
+        }
+        for mode in args.mode:
+            for path in args.path:
+                for concurrency in args.concurrency:
+                    batch, texts = texts[:args.requests], texts[args.requests:]
+                    result = run(engine, batch, mode, concurrency, path)
+                    report["runs"].append(result)
+                    latency = result["latency_ms"]
+                    print(f"{mode:<6} {path:<5} c={concurrency:<4} p50={latency['p50']:.0f}ms p95={latency['p95']:.0f}ms "
+                          f"p99={latency['p99']:.0f}ms  {result['throughput_per_s']:.2f}/s  "
+                          f"threads={result['threads_peak']}  rss={result['rss_mb']['peak']:.0f}MB  "
+                          f"failures={result['failures']}")
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+import argparse
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+from embeddings import get_embedder
+from fingerprint import fingerprint
+from vector_index import load_index, make_index
+
+DEFAULT_PATH = "case_history.sqlite3"
+DEFAULT_INDEX_PATH = "case_history.index"
+logger = logging.getLogger(__name__)
+TOKEN_PATTERN = re.compile(r"<\w+>|[a-z0-9]+")
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Reciprocal rank fusion constant; 60 is the usual choice from the RRF paper
+RRF_K = 60
+REFRESH_CHUNK = 10000
+# count_similar scans one row per distinct fingerprint, which stays cheap only while
+# patterns are far fewer than cases; past this many an IVF index is searched instead
+PATTERN_SCAN_LIMIT = int(os.getenv("CASE_HISTORY_PATTERN_SCAN_LIMIT", "20000"))
+
+
+def tokenize(masked_text):
+    return TOKEN_PATTERN.findall(masked_text)
+
+
+class BM25Index:
+    # Inverted index with per-term postings held as growable numpy doc-id / tf arrays;
+    # documents are appended in id order. Arrays only grow (by reallocation), so a view
+    # taken with view() stays valid and consistent while later documents are added.
+    def __init__(self):
+        self.postings = {}
+        self.lengths = np.zeros(1024, dtype=np.float32)
+        self.count = 0
+        self.total_length = 0
+
+    def add(self, tokens):
+        doc = self.count
+        for term, tf in Counter(tokens).items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = [np.empty(4, dtype=np.int32), np.empty(4, dtype=np.float32), 0]
+            elif entry[2] == len(entry[0]):
+                entry[0] = np.concatenate([entry[0], np.empty_like(entry[0])])
+                entry[1] = np.concatenate([entry[1], np.empty_like(entry[1])])
+            entry[0][entry[2]] = doc
+            entry[1][entry[2]] = tf
+            entry[2] += 1
+        if doc == len(self.lengths):
+            self.lengths = np.concatenate([self.lengths, np.zeros_like(self.lengths)])
+        self.lengths[doc] = len(tokens)
+        self.total_length += len(tokens)
+        self.count += 1
+
+    def view(self, tokens):
+        # Everything a search for `tokens` reads, as of now; cheap enough to take under a lock
+        postings = [self.postings.get(term) for term in set(tokens)]
+        return (
+            self.count, self.total_length, self.lengths[:self.count],
+            [(entry[0][:entry[2]], entry[1][:entry[2]]) for entry in postings if entry is not None],
+        )
+
+    @staticmethod
+    def rank(view, k):
+        # Scores a view() with every term's postings at once; returns the top k (doc, score)
+        count, total_length, lengths, postings = view
+        if not count or not postings:
+            return []
+        average = total_length / count
+        scores = np.zeros(count, dtype=np.float32)
+        for docs, tfs in postings:
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / average)
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return list(zip(hits.tolist(), scores[hits].tolist()))
+
+    def search(self, tokens, k):
+        return self.rank(self.view(tokens), k)
+
+
+class CaseHistory:
+    # Past exceptions with their operator-approved resolutions. Rows live in SQLite;
+    # the BM25 and vector indexes are rebuilt in memory once per process and then
+    # extended incrementally with rows added by this or any other process. With an
+    # index_path, embeddings live in a shared memory-mapped EmbeddingStore there, so
+    # each row is embedded once per host rather than once per process.
+    def __init__(self, path=DEFAULT_PATH, embedder=None, index_kind="exact", index_path=None, store_dtype="float32"):
+        self.path = path
+        self.embedder = embedder or get_embedder()
+        self.index_kind = index_kind
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cases ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, exception TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+            "classification TEXT, resolution TEXT NOT NULL, approved_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._cases = []
+        self._bm25 = BM25Index()
+        self._vectors = None
+        # Cases sharing a fingerprint have identical masked text and therefore identical
+        # embeddings, so similar-case counts only score one row per distinct pattern
+        self._patterns = {}
+        self._pattern_rows = []
+        self._pattern_sizes = []
+        self._warned_patterns = False
+        self._last_id = 0
+        self._store = None
+        if index_path:
+            try:
+                self._store = EmbeddingStore(index_path, store_dtype)
+            except OSError as e:
+                logger.warning("Embedding store %s unavailable (%s); embedding in memory instead", index_path, e)
+        if self._store is not None and len(self._store):
+            self._open_store()
+        self.refresh()
+
+    def __len__(self):
+        return len(self._cases)
+
+    def _open_store(self):
+        store = self._store
+        covered = self._conn.execute("SELECT COUNT(*) FROM cases WHERE id <= ?", (store.last_id,)).fetchone()[0]
+        if covered != len(store):
+            logger.warning("Embedding store %s does not match %s; embedding in memory instead", store.path, self.path)
+            self._store = None
+            return
+        index = None
+        if os.path.exists(os.path.join(store.path, "meta.json")):
+            index, meta = load_index(store.path, store)
+            if meta["kind"] != self.index_kind or meta["size"] > len(store):
+                index = None
+        self._vectors = index or make_index(self.index_kind, store.dimensions, store)
+
+    def save_index(self, retrain=False):
+        self.refresh()
+        if self._vectors is None or not self.index_path:
+            return
+        if retrain:
+            self._vectors.train()
+        with self._lock:
+            self._vectors.save(self.index_path)
+
+    def refresh(self):
+        # Loads rows in chunks so a cold start over a large history never embeds it all at once
+        while self._refresh_chunk():
+            pass
+
+    def _refresh_chunk(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, exception, fingerprint, classification, resolution FROM cases WHERE id > ? ORDER BY id LIMIT ?",
+                (self._last_id, REFRESH_CHUNK),
+            ).fetchall()
+            if not rows:
+                return False
+            masked = [fingerprint(row[1])[0] for row in rows]
+            if self._store is not None:
+                # Another process may already have embedded these rows; extend skips them
+                self._store.extend([row[0] for row in rows], masked, self.embedder.embed)
+                if self._vectors is None:
+                    self._vectors = make_index(self.index_kind, self._store.dimensions, self._store)
+                self._vectors.sync()
+            else:
+                vectors = self.embedder.embed(masked)
+                if self._vectors is None:
+                    self._vectors = make_index(self.index_kind, vectors.shape[1])
+                self._vectors.add(vectors)
+            for row, text in zip(rows, masked):
+                self._bm25.add(tokenize(text))
+                pattern = self._patterns.get(row[2])
+                if pattern is None:
+                    self._patterns[row[2]] = len(self._pattern_sizes)
+                    self._pattern_rows.append(len(self._cases))
+                    self._pattern_sizes.append(1)
+                else:
+                    self._pattern_sizes[pattern] += 1
+                self._cases.append({
+                    "id": row[0],
+                    "exception": row[1],
+                    "fingerprint": row[2],
+                    "classification": row[3],
+                    "resolution": row[4],
+                })
+            self._last_id = rows[-1][0]
+            return len(rows) == REFRESH_CHUNK
+
+    def add_case(self, exception_details, classification, resolution):
+        self.add_cases([(exception_details, classification, resolution)])
+
+    def add_cases(self, cases):
+        # cases: iterable of (exception_details, classification_json, resolution_json)
+        now = time.time()
+        rows = [
+            (exception_details, fingerprint(exception_details)[1], classification, resolution, now)
+            for exception_details, classification, resolution in cases
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO cases (exception, fingerprint, classification, resolution, approved_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+        self.refresh()
+
+    def search(self, exception_details, k=3, min_similarity=0.0):
+        # Hybrid retrieval: BM25 and vector rankings fused with reciprocal rank fusion;
+        # candidates below min_similarity (cosine) are dropped so unrelated cases never pad the prompt
+        self.refresh()
+        if not self._cases:
+            return []
+        masked, _ = fingerprint(exception_details)
+        vector = self.embedder.embed([masked])[0]
+        depth = k * 4
+        # Only the sizes are read under the lock. The indexes only grow, so scoring runs
+        # outside it and ignores rows a concurrent refresh added past this count.
+        with self._lock:
+            count = len(self._cases)
+            terms = self._bm25.view(tokenize(masked))
+        fused = defaultdict(float)
+        for rank, (doc, _) in enumerate(BM25Index.rank(terms, depth)):
+            fused[doc] += 1.0 / (RRF_K + rank + 1)
+        ids, scores = self._vectors.search(vector, depth)
+        similarity = {doc: score for doc, score in zip(ids.tolist(), scores.tolist()) if doc < count}
+        for rank, doc in enumerate(similarity):
+            fused[doc] += 1.0 / (RRF_K + rank + 1)
+        candidates = [(doc, score) for doc, score in fused.items() if similarity.get(doc, -1.0) >= min_similarity]
+        best = heapq.nlargest(k, candidates, key=lambda item: item[1])
+        return [
+            dict(self._cases[doc], score=score, similarity=similarity.get(doc))
+            for doc, score in best
+        ]
+
+    def count_similar(self, exception_details, threshold):
+        # Stored cases with cosine >= threshold. The exact count scans distinct patterns
+        # rather than cases, which keeps it to milliseconds when a million stored breaks
+        # collapse to a few thousand fingerprints. Beyond PATTERN_SCAN_LIMIT patterns an
+        # IVF index counts over its probed lists instead, so the count becomes approximate.
+        self.refresh()
+        if not self._pattern_sizes:
+            return 0
+        masked, _ = fingerprint(exception_details)
+        vector = self.embedder.embed([masked])[0]
+        # As in search, only sizes are read under the lock; the lists are append-only
+        with self._lock:
+            count, patterns = len(self._cases), len(self._pattern_rows)
+        if patterns > PATTERN_SCAN_LIMIT:
+            if self._vectors.kind == "ivf":
+                ids, scores = self._vectors.candidates(vector)
+                return int(((scores >= threshold) & (ids < count)).sum())
+            if not self._warned_patterns:
+                self._warned_patterns = True
+                logger.warning("%d distinct patterns in %s; set CASE_HISTORY_INDEX=ivf to keep similar-case counts fast",
+                               patterns, self.path)
+        scores = self._vectors.row_scores(self._pattern_rows[:patterns], vector)
+        sizes = np.asarray(self._pattern_sizes[:patterns])
+        return int(sizes[scores >= threshold].sum())
+
+
+def approved_classifications(path=DEFAULT_PATH):
+    # (exception_details, classification_json) for every approved case, oldest first;
+    # reads the table directly so harvesting never builds the search indexes
+    with sqlite3.connect(path, timeout=30) as conn:
+        return conn.execute(
+            "SELECT exception, classification FROM cases WHERE classification IS NOT NULL ORDER BY id"
+        ).fetchall()
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_case_history():
+    # Loaded once per process; None when retrieval is disabled
+    global _history
+    if os.getenv("CASE_HISTORY_ENABLED", "1") == "0":
+        return None
+    with _history_lock:
+        if _history is None:
+            _history = _open_history()
+        return _history
+
+
+def _open_history():
+    # CASE_HISTORY_INDEX=ivf switches to approximate search for very large histories
+    return CaseHistory(
+        os.getenv("CASE_HISTORY_PATH", DEFAULT_PATH),
+        index_kind=os.getenv("CASE_HISTORY_INDEX", "exact"),
+        index_path=os.getenv("CASE_HISTORY_INDEX_PATH", DEFAULT_INDEX_PATH),
+        store_dtype=os.getenv("EMBEDDING_STORE_DTYPE", "float32"),
+    )
+
+
+def _as_json(value):
+    return value if value is None or isinstance(value, str) else json.dumps(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the approved-resolution case history.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="add approved cases from a JSONL file")
+    importer.add_argument("input", help="JSONL with exception_details, resolution and optional classification")
+    search = commands.add_parser("search", help="show the cases retrieved for an exception")
+    search.add_argument("exception_details")
+    search.add_argument("-k", type=int, default=3)
+    commands.add_parser("index", help="retrain and save the vector index for faster startup")
+    args = parser.parse_args(argv)
+
+    history = _open_history()
+    if args.command == "import":
+        with open(args.input, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        history.add_cases(
+            (record["exception_details"], _as_json(record.get("classification")), _as_json(record["resolution"]))
+            for record in records
+        )
+        print(f"{len(history)} cases in {history.path}")
+    elif args.command == "index":
+        history.save_index(retrain=True)
+        print(f"{len(history)} cases indexed ({history.index_kind}) in {history.index_path}")
+    else:
+        for case in history.search(args.exception_details, k=args.k):
+            print(json.dumps(case))
+
+
+if __name__ == "__main__":
+    main()
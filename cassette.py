@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+MODES = ("record", "replay", "once")
+# Per-call transport options that must not change which recording a request maps to
+_IGNORED_KWARGS = ("timeout", "extra_headers", "stream_options")
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+class Cassette:
+    # Recorded chat completions in a JSONL file, one request/response per line.
+    #   record: always call through and append the response
+    #   replay: never touch the network; an unrecorded request raises CassetteMiss
+    #   once:   replay when recorded, otherwise call through and record
+    # Repeats of one request replay their recordings in order, then the last one again.
+    def __init__(self, path, mode="once"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}; expected one of {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self._entries = {}
+        self._played = {}
+        self._lock = threading.Lock()
+        if mode != "record" and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+
+    @staticmethod
+    def key(kwargs):
+        request = {name: value for name, value in kwargs.items() if name not in _IGNORED_KWARGS}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        with self._lock:
+            entries = self._entries.get(key)
+            if self.mode == "record" or not entries:
+                if self.mode == "replay":
+                    raise CassetteMiss(f"No recording for request {key[:12]} in {self.path}")
+                return None
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+            return entries[min(played, len(entries) - 1)]
+
+    def record(self, key, kwargs, response):
+        entry = {"key": key, "request": {name: kwargs[name] for name in ("model", "messages", "max_tokens") if name in kwargs}}
+        entry.update(response)
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def replayed(self, entry):
+        if "chunks" in entry:
+            return iter([ChatCompletionChunk.model_validate(chunk) for chunk in entry["chunks"]])
+        return ChatCompletion.model_validate(entry["response"])
+
+    def recording_stream(self, key, kwargs, stream):
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk.model_dump(mode="json"))
+            yield chunk
+        self.record(key, kwargs, {"chunks": chunks})
+
+
+class _Completions:
+    def __init__(self, cassette, completions):
+        self._cassette = cassette
+        self._completions = completions
+
+    def create(self, **kwargs):
+        key = self._cassette.key(kwargs)
+        entry = self._cassette.lookup(key)
+        if entry is not None:
+            return self._cassette.replayed(entry)
+        response = self._completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return self._cassette.recording_stream(key, kwargs, response)
+        self._cassette.record(key, kwargs, {"response": response.model_dump(mode="json")})
+        return response
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, **kwargs):
+        key = self._cassette.key(kwargs)
+        entry = self._cassette.lookup(key)
+        if entry is not None:
+            return self._cassette.replayed(entry)
+        response = await self._completions.create(**kwargs)
+        self._cassette.record(key, kwargs, {"response": response.model_dump(mode="json")})
+        return response
+
+
+def wrap(client, cassette, is_async=False):
+    # Stand-in for an OpenAI client exposing only chat.completions.create
+    completions = (_AsyncCompletions if is_async else _Completions)(cassette, client.chat.completions)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+def install(module, path, mode="once"):
+    # Swaps module.client / module.async_client (e.g. engine) for cassette-backed ones
+    cassette = Cassette(path, mode)
+    module.client = wrap(module.client, cassette)
+    module.async_client = wrap(module.async_client, cassette, is_async=True)
+    return cassette
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not a POSIX host: the store needs flock, pwrite and fdatasync, so it is unavailable
+    fcntl = None
+
+DTYPES = ("float32", "float16")
+
+
+class EmbeddingStore:
+    # Append-only flat file of embeddings (row-major, no padding) plus a small JSON
+    # header recording the committed row count and the last case id embedded.
+    # Readers memory-map the committed rows, so every process on the host shares one
+    # copy through the page cache. Rows past the header count are an interrupted
+    # append and are overwritten by the next one.
+    def __init__(self, path, dtype="float32"):
+        if fcntl is None:
+            raise OSError("EmbeddingStore needs a POSIX host (fcntl is unavailable)")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported embedding dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+        self.path = path
+        self.dtype = dtype
+        self.dimensions = None
+        self.last_id = 0
+        self._count = 0
+        self._map = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._header_path = os.path.join(path, "header.json")
+        self._data_path = os.path.join(path, "vectors.bin")
+        self.refresh()
+
+    def __len__(self):
+        return self._count
+
+    def _read_header(self):
+        try:
+            with open(self._header_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _apply_header(self, header):
+        if header is None:
+            return
+        self.dimensions = header["dimensions"]
+        self.dtype = header["dtype"]
+        self.last_id = header["last_id"]
+        self._count = header["count"]
+
+    def refresh(self):
+        with self._lock:
+            self._apply_header(self._read_header())
+
+    def matrix(self):
+        # Read-only view of the committed rows; remapped only when the count has grown
+        with self._lock:
+            if not self._count:
+                return np.zeros((0, self.dimensions or 0), dtype=self.dtype)
+            if self._map is None or len(self._map) != self._count:
+                self._map = np.memmap(self._data_path, dtype=self.dtype, mode="r", shape=(self._count, self.dimensions))
+            return self._map
+
+    @contextmanager
+    def _exclusive(self):
+        # Serialises writers across processes; readers never take this lock
+        with open(os.path.join(self.path, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append(self, vectors, last_id):
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        header = self._read_header() or {"dimensions": vectors.shape[1], "dtype": self.dtype, "count": 0, "last_id": 0}
+        if vectors.shape[1] != header["dimensions"]:
+            raise ValueError(f"Embedding has {vectors.shape[1]} dimensions, store holds {header['dimensions']}")
+        row_bytes = header["dimensions"] * np.dtype(header["dtype"]).itemsize
+        fd = os.open(self._data_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, header["count"] * row_bytes)
+            os.pwrite(fd, vectors.tobytes(), header["count"] * row_bytes)
+            os.fdatasync(fd)
+        finally:
+            os.close(fd)
+        header = dict(header, count=header["count"] + len(vectors), last_id=last_id)
+        tmp = f"{self._header_path}.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        os.replace(tmp, self._header_path)
+        with self._lock:
+            self._apply_header(header)
+
+    def append(self, vectors, last_id=None):
+        with self._exclusive():
+            self.refresh()
+            self._append(vectors, self.last_id if last_id is None else last_id)
+
+    def extend(self, ids, texts, embed):
+        # Embeds and appends only rows newer than what any process has already stored;
+        # ids must be ascending. Returns the number of rows this call appended.
+        with self._exclusive():
+            self.refresh()
+            pending = [(i, text) for i, text in zip(ids, texts) if i > self.last_id]
+            if not pending:
+                return 0
+            self._append(embed([text for _, text in pending]), pending[-1][0])
+            return len(pending)
@@ -0,0 +1,78 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+DEFAULT_DIMENSIONS = 512
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Texts per bincount pass; bounds the float64 scratch to block * dimensions
+_EMBED_BLOCK = 2048
+
+
+class HashingEmbedder:
+    # Offline embedder: signed feature hashing of word unigrams and bigrams with
+    # sublinear term frequency, L2-normalised so dot products are cosine similarities.
+    # Digits collapse to 0 so breaks differing only by IDs, dates or amounts stay close.
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _features(self, text):
+        tokens = TOKEN_PATTERN.findall(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts):
+        texts = list(texts)
+        if len(texts) <= _EMBED_BLOCK:
+            return self._embed_block(texts)
+        return np.concatenate([self._embed_block(texts[i:i + _EMBED_BLOCK]) for i in range(0, len(texts), _EMBED_BLOCK)])
+
+    def _embed_block(self, texts):
+        # Lowercasing and digit folding run once over the whole block, then every
+        # feature is hashed in one pass and scattered with a single bincount
+        texts = re.sub(r"\d", "0", "\n".join(text.replace("\n", " ") for text in texts).lower()).split("\n") if texts else []
+        rows, features = [], []
+        for row, text in enumerate(texts):
+            text_features = self._features(text)
+            rows.extend([row] * len(text_features))
+            features.extend(text_features)
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+        slots = np.asarray(rows, dtype=np.int64) * self.dimensions + hashes % self.dimensions
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vectors = np.bincount(slots, weights=signs, minlength=len(texts) * self.dimensions)
+        vectors = vectors.reshape(len(texts), self.dimensions).astype(np.float32)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class OpenAIEmbedder:
+    def __init__(self, client, model="text-embedding-3-small"):
+        self.client = client
+        self.model = model
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=list(texts))
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    # EMBEDDER=openai uses the embeddings API; the default hashing embedder needs no network
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            if os.getenv("EMBEDDER", "hashing") == "openai":
+                from openai import OpenAI
+                _embedder = OpenAIEmbedder(
+                    OpenAI(api_key=os.getenv("OPENAI_API_KEY")),
+                    model=os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"),
+                )
+            else:
+                _embedder = HashingEmbedder(int(os.getenv("EMBEDDING_DIMENSIONS", DEFAULT_DIMENSIONS)))
+        return _embedder
@@ -0,0 +1,986 @@
+from openai import AsyncOpenAI, OpenAI
+import asyncio
+import copy
+import json
+import logging
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+import csv
+from dotenv import load_dotenv
+import os
+from agent_executor import get_agent_executor
+from case_history import get_case_history
+from cassette import Cassette, wrap as wrap_client
+from fingerprint import fingerprint
+from local_classifier import get_fast_path
+from metrics import collecting, get_metrics, request_calls, request_summary
+from model_router import get_model_router
+from rate_limiter import estimate_tokens, get_rate_limiter
+from result_cache import cache_key, get_result_cache
+from retry import get_retry_policy, remaining
+from semantic_cache import get_semantic_cache, mark_hit
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Initialize OpenAI clients; the async one backs batch jobs that keep many calls in flight.
+# Retries are handled by _chat/_chat_async so they can respect rate limits and deadlines.
+# OPENAI_BASE_URL (read by the SDK) can point them at `python -m mock_openai` instead.
+CASSETTE_PATH = os.getenv("OPENAI_CASSETTE")
+CASSETTE_MODE = os.getenv("OPENAI_CASSETTE_MODE", "once")
+# A pure replay never reaches the API, so it does not need a real key
+_api_key = os.getenv("OPENAI_API_KEY") or ("replay" if CASSETTE_PATH and CASSETTE_MODE == "replay" else None)
+client = OpenAI(api_key=_api_key, max_retries=0)
+async_client = AsyncOpenAI(api_key=_api_key, max_retries=0)
+if CASSETTE_PATH:
+    # Record/replay completions to a JSONL cassette for deterministic, offline tests and benchmarks
+    _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+    client = wrap_client(client, _cassette)
+    async_client = wrap_client(async_client, _cassette, is_async=True)
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+
+AGENT_TIMEOUT_SECONDS = float(os.getenv("AGENT_TIMEOUT_SECONDS", "60"))
+# Overall budget for one exception, retries included; bounds tail latency
+EXCEPTION_DEADLINE_SECONDS = float(os.getenv("EXCEPTION_DEADLINE_SECONDS", "120"))
+# Feed the classification into the resolution prompt; serializes the two calls
+RESOLUTION_USES_CLASSIFICATION = os.getenv("RESOLUTION_USES_CLASSIFICATION", "0") == "1"
+# Tiered models: classification on a small model, its complexity/priority picks the rest (see model_router)
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "0") == "1"
+# The UI streams the explanation token by token in agents mode unless this is "0"
+STREAM_EXPLANATION = os.getenv("STREAM_EXPLANATION", "1") == "1"
+# "agents" runs the three-agent graph; "fused" asks for all three answers in one call
+PIPELINE_MODES = ("agents", "fused")
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "agents")
+# Exceptions processed in parallel by bulk uploads and the batch CLI
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Approved past cases injected into the resolution prompt
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MIN_SIMILARITY = float(os.getenv("RETRIEVAL_MIN_SIMILARITY", "0.2"))
+SIMILAR_CASE_THRESHOLD = float(os.getenv("SIMILAR_CASE_THRESHOLD", "0.8"))
+
+# Bump whenever an agent prompt changes so cached results from old prompts are not reused
+PROMPT_VERSION = "3"
+
+def _classification_messages(exception_details):
+    prompt = (
+        "You are an expert in fund administration exception management. "
+        "Based on the following exception details, classify the exception by type, priority, and complexity:\n\n"
+        f"{exception_details}\n\n"
+        "Provide your answer in a JSON format with keys 'type', 'priority', and 'complexity'."
+    )
+    return [
+        {"role": "system", "content": "You are a classification expert. Always return valid JSON."}, 
+        {"role": "user", "content": prompt}
+    ]
+
+def _classification_error(e):
+    if isinstance(e, json.JSONDecodeError):
+        return json.dumps({
+            "type": "Error: Invalid response format",
+            "priority": "N/A",
+            "complexity": f"Failed to process the classification: {str(e)}"
+        })
+    return json.dumps({
+        "type": "Error: System error",
+        "priority": "N/A",
+        "complexity": f"An unexpected error occurred: {str(e)}"
+    })
+
+def _format_cases(cases):
+    lines = ["Historical resolution patterns (similar past exceptions and their approved resolutions):"]
+    for number, case in enumerate(cases, 1):
+        try:
+            resolution = json.loads(case["resolution"])
+            resolution = f"{resolution.get('suggestion', '')} (rationale: {resolution.get('rationale', '')})"
+        except (TypeError, AttributeError, json.JSONDecodeError):
+            resolution = case["resolution"]
+        lines.append(f"{number}. Exception: {case['exception'][:500]}\n   Approved resolution: {resolution}")
+    return "\n".join(lines) + "\n\n"
+
+def _resolution_messages(exception_details, classification=None, similar_cases=None):
+    context = f"Classification: {classification}\n\n" if classification else ""
+    if similar_cases:
+        context += _format_cases(similar_cases)
+    prompt = (
+        "You are a fund administration expert. Given the following exception details and historical resolution patterns, "
+        "suggest a corrective action. Include a confidence score (as a percentage string) and rationale for your recommendation.\n\n"
+        f"{exception_details}\n\n"
+        f"{context}"
+        "Present your answer in a valid JSON format with the following structure:\n"
+        "{'suggestion': 'your suggestion here', 'confidence': '85%', 'rationale': 'your rationale here'}"
+    )
+    return [
+        {"role": "system", "content": "You are a resolution suggestion expert. Always return valid JSON."}, 
+        {"role": "user", "content": prompt}
+    ]
+
+def _resolution_error(e):
+    if isinstance(e, json.JSONDecodeError):
+        return json.dumps({
+            "suggestion": "Error: Invalid response format",
+            "confidence": "0%",
+            "rationale": f"Failed to process the suggestion: {str(e)}"
+        })
+    return json.dumps({
+        "suggestion": "Error: System error",
+        "confidence": "0%",
+        "rationale": f"An unexpected error occurred: {str(e)}"
+    })
+
+def _explanation_messages(suggestion_details):
+    prompt = (
+        "Explain the following resolution suggestion in clear, concise natural language so that an operator can easily understand it:\n\n"
+        f"{suggestion_details}"
+    )
+    return [
+        {"role": "system", "content": "You are an explanation expert."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _similar_cases(exception_details):
+    # Retrieval only enriches the prompt, so a broken history never fails the agent
+    history = get_case_history()
+    if history is None or not RETRIEVAL_TOP_K:
+        return []
+    try:
+        return history.search(exception_details, k=RETRIEVAL_TOP_K, min_similarity=RETRIEVAL_MIN_SIMILARITY)
+    except Exception as e:
+        logger.warning("Case history retrieval failed: %s", e)
+        return []
+
+def similar_case_count(exception_details):
+    # Number of stored cases within SIMILAR_CASE_THRESHOLD cosine; None when history is unavailable
+    history = get_case_history()
+    if history is None:
+        return None
+    try:
+        return history.count_similar(exception_details, SIMILAR_CASE_THRESHOLD)
+    except Exception as e:
+        logger.warning("Similar case count failed: %s", e)
+        return None
+
+def _validated_json(content):
+    # Ensure the response is valid JSON
+    json.loads(content)
+    return content
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+def _request_options(deadline):
+    left = remaining(deadline)
+    if left is None:
+        return {}
+    if left <= 0:
+        raise TimeoutError("Exception deadline exceeded")
+    return {"timeout": left}
+
+def _chat(model, messages, max_tokens, deadline=None, stats=None):
+    # Every completion goes through the shared rate limiter so batch load queues instead of drawing 429s,
+    # and transient failures (429/5xx/timeouts) are retried with jittered backoff until the deadline.
+    # stats["retries"], when given, counts the retries.
+    limiter = get_rate_limiter()
+    policy = get_retry_policy()
+    estimate = estimate_tokens(messages, max_tokens)
+    attempt = 0
+    while True:
+        limiter.acquire(model, estimate, deadline=deadline)
+        try:
+            response = client.chat.completions.create(
+                model=model, messages=messages, max_tokens=max_tokens, **_request_options(deadline)
+            )
+        except Exception as e:
+            delay = policy.next_delay(attempt, e, deadline)
+            if delay is None:
+                raise
+            logger.warning("Retrying %s call in %.1fs after %s", model, delay, e)
+            time.sleep(delay)
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = attempt
+            continue
+        limiter.reconcile(model, estimate, _usage_tokens(response))
+        return response
+
+async def _chat_async(model, messages, max_tokens, deadline=None, stats=None):
+    limiter = get_rate_limiter()
+    policy = get_retry_policy()
+    estimate = estimate_tokens(messages, max_tokens)
+    attempt = 0
+    while True:
+        await limiter.acquire_async(model, estimate, deadline=deadline)
+        try:
+            response = await async_client.chat.completions.create(
+                model=model, messages=messages, max_tokens=max_tokens, **_request_options(deadline)
+            )
+        except Exception as e:
+            delay = policy.next_delay(attempt, e, deadline)
+            if delay is None:
+                raise
+            logger.warning("Retrying %s call in %.1fs after %s", model, delay, e)
+            await asyncio.sleep(delay)
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = attempt
+            continue
+        limiter.reconcile(model, estimate, _usage_tokens(response))
+        return response
+
+def _agent_model(router, agent, classification=None):
+    # Returns (route name, model) for one agent call
+    if router is None:
+        return None, MODEL
+    if agent in ("classification", "fused"):
+        return agent, router.table[agent]
+    route = router.route(classification)
+    return route["name"], route[agent]
+
+def _record_call(route, agent, model, started, usage, stats, error=None):
+    # Every LLM call lands in the metrics registry (and the current request's calls)
+    get_metrics().record(agent, model, time.perf_counter() - started, usage, retries=stats["retries"], error=error, route=route)
+
+def _routed_chat(agent, messages, max_tokens, deadline, classification=None):
+    router = get_model_router()
+    route, model = _agent_model(router, agent, classification)
+    stats = {"retries": 0}
+    started = time.perf_counter()
+    try:
+        response = _chat(model, messages, max_tokens, deadline=deadline, stats=stats)
+    except Exception as e:
+        _record_call(route, agent, model, started, None, stats, error=type(e).__name__)
+        raise
+    _record_call(route, agent, model, started, getattr(response, "usage", None), stats)
+    return response
+
+async def _routed_chat_async(agent, messages, max_tokens, deadline, classification=None):
+    router = get_model_router()
+    route, model = _agent_model(router, agent, classification)
+    stats = {"retries": 0}
+    started = time.perf_counter()
+    try:
+        response = await _chat_async(model, messages, max_tokens, deadline=deadline, stats=stats)
+    except Exception as e:
+        _record_call(route, agent, model, started, None, stats, error=type(e).__name__)
+        raise
+    _record_call(route, agent, model, started, getattr(response, "usage", None), stats)
+    return response
+
+def _prompt_classification(classification):
+    # Routing may hand the resolution agent a classification it should not put in the prompt
+    return classification if RESOLUTION_USES_CLASSIFICATION else None
+
+def _chat_stream(model, messages, max_tokens, deadline=None, stats=None):
+    # Streaming counterpart of _chat: yields content deltas and returns the usage reported in the
+    # final chunk. Retries only cover opening the stream; a failure mid-stream propagates.
+    limiter = get_rate_limiter()
+    policy = get_retry_policy()
+    estimate = estimate_tokens(messages, max_tokens)
+    attempt = 0
+    while True:
+        limiter.acquire(model, estimate, deadline=deadline)
+        try:
+            stream = client.chat.completions.create(
+                model=model, messages=messages, max_tokens=max_tokens, stream=True,
+                stream_options={"include_usage": True}, **_request_options(deadline)
+            )
+        except Exception as e:
+            delay = policy.next_delay(attempt, e, deadline)
+            if delay is None:
+                raise
+            logger.warning("Retrying %s stream in %.1fs after %s", model, delay, e)
+            time.sleep(delay)
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = attempt
+            continue
+        break
+    usage = None
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        limiter.reconcile(model, estimate, getattr(usage, "total_tokens", None))
+    return usage
+
+def _routed_chat_stream(agent, messages, max_tokens, deadline, classification=None):
+    # Not a generator itself: the request's metrics are captured where the stream is created,
+    # since the consumer may iterate it from another context
+    router = get_model_router()
+    route, model = _agent_model(router, agent, classification)
+    calls = request_calls()
+
+    def stream():
+        stats = {"retries": 0}
+        started = time.perf_counter()
+        try:
+            usage = yield from _chat_stream(model, messages, max_tokens, deadline=deadline, stats=stats)
+        except Exception as e:
+            with collecting(calls):
+                _record_call(route, agent, model, started, None, stats, error=type(e).__name__)
+            raise
+        with collecting(calls):
+            _record_call(route, agent, model, started, usage, stats)
+
+    return stream()
+
+def _local_classification(exception_details):
+    # Returns (fast path, local answer or None); any failure of the local classifier
+    # escalates to the LLM instead of failing the classification
+    fast_path = None
+    try:
+        fast_path = get_fast_path()
+        return fast_path, fast_path.classify(exception_details) if fast_path is not None else None
+    except Exception as e:
+        logger.error("Local classifier failed, escalating: %s", e)
+        return fast_path, None
+
+def classification_agent(exception_details, deadline=None):
+    # Routine breaks are answered by the local classifier; only the rest reach the LLM
+    fast_path, local = _local_classification(exception_details)
+    if local is not None:
+        return local
+    started = time.perf_counter()
+    try:
+        response = _routed_chat("classification", _classification_messages(exception_details), 150, deadline)
+        return _validated_json(response.choices[0].message.content)
+    except Exception as e:
+        return _classification_error(e)
+    finally:
+        if fast_path is not None:
+            fast_path.record_escalation(time.perf_counter() - started)
+
+def resolution_suggestion_agent(exception_details, classification=None, deadline=None, refresh=False):
+    try:
+        # Near-duplicate breaks (same pattern, different IDs/dates/amounts) reuse a stored resolution;
+        # embedding the masked text keeps those volatile tokens from diluting the similarity.
+        # refresh skips the lookup and replaces the entry it would have returned.
+        semantic_cache = get_semantic_cache()
+        if semantic_cache is not None:
+            vector = semantic_cache.embed(fingerprint(exception_details)[0])
+            hit = None if refresh else semantic_cache.lookup(vector)
+            if hit is not None:
+                return mark_hit(hit)
+        similar_cases = _similar_cases(exception_details)
+        messages = _resolution_messages(exception_details, _prompt_classification(classification), similar_cases)
+        response = _routed_chat("resolution", messages, 200, deadline, classification)
+        content = _validated_json(response.choices[0].message.content)
+        if semantic_cache is not None:
+            semantic_cache.add(vector, exception_details, content, replace=refresh)
+        return content
+    except Exception as e:
+        return _resolution_error(e)
+
+def explanation_agent(suggestion_details, classification=None, deadline=None):
+    response = _routed_chat("explanation", _explanation_messages(suggestion_details), 150, deadline, classification)
+    return response.choices[0].message.content
+
+def explanation_agent_stream(suggestion_details, classification=None, deadline=None):
+    return _routed_chat_stream("explanation", _explanation_messages(suggestion_details), 150, deadline, classification)
+
+async def classification_agent_async(exception_details, deadline=None):
+    fast_path, local = _local_classification(exception_details)
+    if local is not None:
+        return local
+    started = time.perf_counter()
+    try:
+        response = await _routed_chat_async("classification", _classification_messages(exception_details), 150, deadline)
+        return _validated_json(response.choices[0].message.content)
+    except Exception as e:
+        return _classification_error(e)
+    finally:
+        if fast_path is not None:
+            fast_path.record_escalation(time.perf_counter() - started)
+
+async def resolution_suggestion_agent_async(exception_details, classification=None, deadline=None):
+    try:
+        semantic_cache = get_semantic_cache()
+        if semantic_cache is not None:
+            # Embedding may be a network call, keep it off the event loop
+            vector = await asyncio.to_thread(semantic_cache.embed, fingerprint(exception_details)[0])
+            hit = semantic_cache.lookup(vector)
+            if hit is not None:
+                return mark_hit(hit)
+        similar_cases = await asyncio.to_thread(_similar_cases, exception_details)
+        messages = _resolution_messages(exception_details, _prompt_classification(classification), similar_cases)
+        response = await _routed_chat_async("resolution", messages, 200, deadline, classification)
+        content = _validated_json(response.choices[0].message.content)
+        if semantic_cache is not None:
+            semantic_cache.add(vector, exception_details, content)
+        return content
+    except Exception as e:
+        return _resolution_error(e)
+
+async def explanation_agent_async(suggestion_details, classification=None, deadline=None):
+    response = await _routed_chat_async("explanation", _explanation_messages(suggestion_details), 150, deadline, classification)
+    return response.choices[0].message.content
+
+def _fused_messages(exception_details):
+    prompt = (
+        "You are an expert in fund administration exception management. For the following exception details:\n\n"
+        f"{exception_details}\n\n"
+        "1. Classify the exception by type, priority, and complexity.\n"
+        "2. Suggest a corrective action with a confidence score (as a percentage string) and rationale for your recommendation.\n"
+        "3. Explain that suggestion in clear, concise natural language so that an operator can easily understand it.\n\n"
+        "Present your answer as a single valid JSON object with the following structure:\n"
+        '{"classification": {"type": "...", "priority": "...", "complexity": "..."}, '
+        '"resolution": {"suggestion": "...", "confidence": "85%", "rationale": "..."}, '
+        '"explanation": "..."}'
+    )
+    return [
+        {"role": "system", "content": "You are an exception management expert. Always return valid JSON."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _fused_error(e):
+    return {
+        "classification": _classification_error(e),
+        "resolution": _resolution_error(e),
+        "explanation": f"Error: {e}"
+    }
+
+def _split_fused(content):
+    # Fan the single response back out into the same shape the three agents produce
+    data = json.loads(content)
+    return {
+        "classification": json.dumps(data["classification"]),
+        "resolution": json.dumps(data["resolution"]),
+        "explanation": str(data["explanation"])
+    }
+
+def fused_agent(exception_details, deadline=None):
+    try:
+        response = _routed_chat("fused", _fused_messages(exception_details), 500, deadline)
+        return _split_fused(response.choices[0].message.content)
+    except Exception as e:
+        return _fused_error(e)
+
+async def fused_agent_async(exception_details, deadline=None):
+    try:
+        response = await _routed_chat_async("fused", _fused_messages(exception_details), 500, deadline)
+        return _split_fused(response.choices[0].message.content)
+    except Exception as e:
+        return _fused_error(e)
+
+# Agent dependency graph: each node lists the inputs its agent is called with, in order.
+# "exception" is the raw exception text; any other name is the output of that upstream node.
+AGENT_INPUTS = {
+    "classification": ("exception",),
+    "resolution": ("exception", "classification") if RESOLUTION_USES_CLASSIFICATION or MODEL_ROUTING else ("exception",),
+    "explanation": ("resolution", "classification") if MODEL_ROUTING else ("resolution",),
+}
+
+# Edges that only pick a model: when classification fails these agents still run, on the default route
+ROUTING_ONLY_INPUTS = {
+    (name, "classification") for name in ("resolution", "explanation")
+    if MODEL_ROUTING and not (name == "resolution" and RESOLUTION_USES_CLASSIFICATION)
+}
+
+AGENTS = {
+    "classification": classification_agent,
+    "resolution": resolution_suggestion_agent,
+    "explanation": explanation_agent
+}
+
+# Agents with a cache of their own that a reprocess must bypass
+REFRESHABLE_AGENTS = ("resolution",)
+ASYNC_AGENTS = {
+    "classification": classification_agent_async,
+    "resolution": resolution_suggestion_agent_async,
+    "explanation": explanation_agent_async
+}
+
+def _topological_order(inputs):
+    order = []
+    state = {}
+
+    def visit(name):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Agent graph has a cycle through '{name}'")
+        state[name] = "visiting"
+        for dep in inputs[name]:
+            if dep != "exception":
+                visit(dep)
+        state[name] = "done"
+        order.append(name)
+
+    for name in inputs:
+        visit(name)
+    return order
+
+def _agent_failed(name, value):
+    if not value or str(value).startswith("Error"):
+        return True
+    field = {"classification": "type", "resolution": "suggestion"}.get(name)
+    if field is None:
+        return False
+    try:
+        return str(json.loads(value).get(field, "")).startswith("Error")
+    except (TypeError, AttributeError, json.JSONDecodeError):
+        return True
+
+def _agent_args(name, exception_details, results):
+    args = []
+    for dep in AGENT_INPUTS[name]:
+        if dep == "exception":
+            args.append(exception_details)
+        elif _agent_failed(dep, results[dep]):
+            if (name, dep) in ROUTING_ONLY_INPUTS:
+                args.append(None)
+                continue
+            # No point paying for a call that would only explain or extend an error
+            return None, f"Error: skipped because {dep} failed"
+        else:
+            args.append(results[dep])
+    return args, None
+
+def _critical_path(timings):
+    # Walk back from the last node to finish, always through the upstream node that finished last
+    if not timings:
+        return []
+    name = max(timings, key=lambda n: timings[n]["end"])
+    path = [name]
+    while True:
+        deps = [dep for dep in AGENT_INPUTS.get(name, ()) if dep in timings]
+        if not deps:
+            break
+        name = max(deps, key=lambda n: timings[n]["end"])
+        path.append(name)
+    return list(reversed(path))
+
+def _timing_summary(timings, started):
+    return {
+        "total": time.perf_counter() - started,
+        "agents": {
+            name: {"start": t["start"] - started, "duration": t["end"] - t["start"]}
+            for name, t in timings.items()
+        },
+        "critical_path": _critical_path(timings),
+    }
+
+def _cache_key(exception_details, mode):
+    if mode == "fused":
+        shape = "fused"
+    else:
+        shape = ";".join(f"{name}<{','.join(deps)}" for name, deps in AGENT_INPUTS.items())
+    router = get_model_router()
+    if router is not None:
+        shape = f"{shape}|routes={router.signature}"
+    return cache_key(exception_details, MODEL, f"{PROMPT_VERSION}|{shape}")
+
+def analysis_complete(results):
+    # True when every agent produced a usable answer; only these are cached or
+    # counted as done when a batch run resumes
+    return all(not _agent_failed(name, results.get(name)) for name in AGENT_INPUTS)
+
+def _timed_call(func, args, deadline, calls=None, **options):
+    # Runs on an executor thread; calls carries the submitting request's metrics across
+    with collecting(calls):
+        start = time.perf_counter()
+        value = func(*args, deadline=deadline, **options)
+    return value, start, time.perf_counter()
+
+def _run_agent_graph(exception_details, on_error, deadline, inputs=AGENT_INPUTS, refresh=False):
+    executor = get_agent_executor()
+    order = _topological_order(inputs)
+    results = {}
+    timings = {}
+    running = {}
+    while order or running:
+        # Launch every node whose inputs are ready; independent nodes run concurrently
+        for name in [n for n in order if all(d == "exception" or d in results for d in inputs[n])]:
+            order.remove(name)
+            args, skipped = _agent_args(name, exception_details, results)
+            if skipped:
+                results[name] = skipped
+            else:
+                options = {"refresh": True} if refresh and name in REFRESHABLE_AGENTS else {}
+                running[executor.submit(_timed_call, AGENTS[name], args, deadline, request_calls(), **options)] = name
+        if not running:
+            continue
+        done, _ = wait(running, timeout=remaining(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            # Out of time: stop waiting on stragglers, their calls give up at the same deadline
+            for name in list(running.values()) + order:
+                on_error(f"Error in {name}: missed the per-exception deadline")
+                results[name] = f"Error: {name} missed the per-exception deadline"
+            break
+        for future in done:
+            agent_name = running.pop(future)
+            try:
+                results[agent_name], start, end = future.result()
+                timings[agent_name] = {"start": start, "end": end}
+            except Exception as e:
+                on_error(f"Error in {agent_name}: {str(e)}")
+                results[agent_name] = f"Error: {e}"
+    return results, timings
+
+def _run_fused(exception_details, deadline):
+    future = get_agent_executor().submit(_timed_call, fused_agent, [exception_details], deadline, request_calls())
+    try:
+        results, start, end = future.result(timeout=remaining(deadline))
+    except FuturesTimeoutError:
+        return _fused_error(TimeoutError("missed the per-exception deadline")), {}
+    return results, {"fused": {"start": start, "end": end}}
+
+# Identical exceptions submitted concurrently (e.g. several operators pasting the same
+# break) share one in-flight analysis instead of each paying for their own agent calls
+_inflight = SingleFlight()
+_inflight_async = AsyncSingleFlight()
+
+def _route_summary(results, mode):
+    router = get_model_router()
+    if router is None:
+        return None
+    if mode == "fused":
+        return {"name": "fused", "models": {"fused": router.fused_model}}
+    route = router.route(results.get("classification"))
+    return {"name": route["name"], "models": {
+        "classification": router.classification_model,
+        "resolution": route["resolution"],
+        "explanation": route["explanation"],
+    }}
+
+def _analyse(exception_details, mode, on_error, deadline, cache, key, exception_fingerprint, refresh=False):
+    started = time.perf_counter()
+    with collecting([]) as calls:
+        if mode == "fused":
+            results, timings = _run_fused(exception_details, deadline)
+        else:
+            results, timings = _run_agent_graph(exception_details, on_error, deadline, refresh=refresh)
+    if cache is not None and analysis_complete(results):
+        cache.set(key, results)
+    results["timings"] = _timing_summary(timings, started)
+    results["metrics"] = request_summary(calls)
+    results["mode"] = mode
+    # Set before the result is published to callers sharing it through single-flight
+    results["fingerprint"] = exception_fingerprint
+    route = _route_summary(results, mode)
+    if route is not None:
+        results["route"] = route
+    return results
+
+def process_exception(exception_details, mode=None, on_error=logger.error, deadline_seconds=None, refresh=False):
+    # on_error receives failures that are also recorded in the results; the UI passes st.error.
+    # refresh skips the result and semantic cache lookups; the fresh answers replace the cached ones.
+    mode = mode or PIPELINE_MODE
+    deadline = time.monotonic() + (EXCEPTION_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    try:
+        _, exception_fingerprint = fingerprint(exception_details)
+        cache = get_result_cache()
+        key = _cache_key(exception_details, mode)
+        if cache is not None and not refresh:
+            cached = cache.get(key)
+            if cached is not None:
+                cached["cached"] = True
+                cached["mode"] = mode
+                cached["fingerprint"] = exception_fingerprint
+                return cached
+
+        # A reprocess must not join an in-flight analysis that may still use cached answers
+        results, shared = _inflight.do(
+            f"{key}|refresh" if refresh else key,
+            lambda: _analyse(exception_details, mode, on_error, deadline, cache, key, exception_fingerprint, refresh),
+            timeout=remaining(deadline),
+        )
+        if shared:
+            results["coalesced"] = True
+        return results
+    except Exception as e:
+        on_error(f"Main process error: {str(e)}")
+        return {}
+
+# Marks the end of the explanation pieces queued by _finish_explanation
+_STREAM_END = object()
+
+def _finish_explanation(exception_details, results, deadline, cache, key, started, calls, pieces, publish):
+    # Runs on the agent executor so the explanation call always completes, whether or not
+    # the UI reads the stream to the end. Pieces are queued for the UI as they arrive; the
+    # finished results are timed, measured and cached exactly like a non-streamed analysis,
+    # then published to identical requests waiting on this one and returned to the stream.
+    try:
+        args, skipped = _agent_args("explanation", exception_details, results)
+        start = time.perf_counter()
+        if skipped:
+            results["explanation"] = skipped
+            pieces.put(skipped)
+        else:
+            chunks = []
+            try:
+                with collecting(calls):
+                    for chunk in explanation_agent_stream(*args, deadline=deadline):
+                        if not chunks:
+                            results["timings"]["first_token"] = time.perf_counter() - started
+                        chunks.append(chunk)
+                        pieces.put(chunk)
+                results["explanation"] = "".join(chunks)
+            except Exception as e:
+                logger.error("Error in explanation: %s", e)
+                results["explanation"] = f"Error: {e}"
+                pieces.put(f"\n\n{results['explanation']}")
+        end = time.perf_counter()
+        timings = results["timings"]
+        timings["agents"]["explanation"] = {"start": start - started, "duration": end - start}
+        timings["total"] = end - started
+        timings["critical_path"] = _critical_path({
+            name: {"end": t["start"] + t["duration"]} for name, t in timings["agents"].items()
+        })
+        results["metrics"] = request_summary(calls)
+        if cache is not None and analysis_complete(results):
+            cache.set(key, {name: results[name] for name in AGENT_INPUTS})
+        publish(result=results)
+        return results
+    except BaseException as e:
+        publish(error=e)
+        raise
+    finally:
+        pieces.put(_STREAM_END)
+
+def _explanation_pieces(results, pieces, job):
+    # What the UI iterates: the queued pieces, then the finished explanation, timings and
+    # metrics copied into results. Abandoning it leaves the explanation call unaffected.
+    while True:
+        piece = pieces.get()
+        if piece is _STREAM_END:
+            break
+        yield piece
+    try:
+        final = job.result()
+    except Exception as e:
+        results["explanation"] = f"Error: {e}"
+    else:
+        for name in ("explanation", "timings", "metrics"):
+            results[name] = copy.deepcopy(final[name])
+    results.pop("explanation_stream", None)
+
+def process_exception_streaming(exception_details, on_error=logger.error, deadline_seconds=None, refresh=False):
+    # Agents mode with a streamed explanation: classification and resolution run as usual,
+    # then results["explanation_stream"] yields the explanation as it is generated and fills
+    # results["explanation"] when exhausted. Cache hits, and identical exceptions that join an
+    # analysis already in flight (streamed or not), come back complete, without a stream.
+    deadline = time.monotonic() + (EXCEPTION_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    started = time.perf_counter()
+    try:
+        _, exception_fingerprint = fingerprint(exception_details)
+        cache = get_result_cache()
+        key = _cache_key(exception_details, "agents")
+        if cache is not None and not refresh:
+            cached = cache.get(key)
+            if cached is not None:
+                cached["cached"] = True
+                cached["mode"] = "agents"
+                cached["fingerprint"] = exception_fingerprint
+                return cached
+
+        # Same single-flight key as process_exception, so streamed and plain requests coalesce
+        flight_key = f"{key}|refresh" if refresh else key
+        future, leader = _inflight.join(flight_key)
+        if not leader:
+            try:
+                results = copy.deepcopy(future.result(timeout=remaining(deadline)))
+                results["coalesced"] = True
+                return results
+            except FuturesTimeoutError:
+                logger.warning("Shared analysis missed this request's deadline; analysing it separately")
+                future = None
+
+        def publish(result=None, error=None):
+            if future is not None:
+                _inflight.finish(flight_key, future, result, error)
+
+        try:
+            inputs = {name: deps for name, deps in AGENT_INPUTS.items() if name != "explanation"}
+            with collecting([]) as calls:
+                results, timings = _run_agent_graph(exception_details, on_error, deadline, inputs, refresh)
+            results["explanation"] = None
+            results["timings"] = _timing_summary(timings, started)
+            results["metrics"] = request_summary(calls)
+            results["mode"] = "agents"
+            results["fingerprint"] = exception_fingerprint
+            route = _route_summary(results, "agents")
+            if route is not None:
+                results["route"] = route
+            pieces = queue.Queue()
+            job = get_agent_executor().submit(
+                _finish_explanation, exception_details, copy.deepcopy(results), deadline, cache, key,
+                started, calls, pieces, publish, timeout=remaining(deadline),
+            )
+            results["explanation_stream"] = _explanation_pieces(results, pieces, job)
+            return results
+        except BaseException as e:
+            publish(error=e)
+            raise
+    except Exception as e:
+        on_error(f"Main process error: {str(e)}")
+        return {}
+
+def _agent_timeout(timeout, deadline):
+    left = remaining(deadline)
+    return timeout if left is None else min(timeout, left)
+
+async def _run_agent_graph_async(exception_details, timeout, deadline):
+    results = {}
+    timings = {}
+    tasks = {}
+
+    async def run(name):
+        for dep in AGENT_INPUTS[name]:
+            if dep != "exception":
+                await tasks[dep]
+        args, skipped = _agent_args(name, exception_details, results)
+        if skipped:
+            results[name] = skipped
+            return
+        start = time.perf_counter()
+        agent_timeout = _agent_timeout(timeout, deadline)
+        try:
+            results[name] = await asyncio.wait_for(ASYNC_AGENTS[name](*args, deadline=deadline), timeout=agent_timeout)
+        except asyncio.TimeoutError:
+            results[name] = f"Error: {name} timed out after {agent_timeout:g}s"
+        except Exception as e:
+            results[name] = f"Error: {e}"
+        timings[name] = {"start": start, "end": time.perf_counter()}
+
+    for name in _topological_order(AGENT_INPUTS):
+        tasks[name] = asyncio.ensure_future(run(name))
+    await asyncio.gather(*tasks.values())
+    return {name: results[name] for name in AGENT_INPUTS}, timings
+
+async def _run_fused_async(exception_details, timeout, deadline):
+    start = time.perf_counter()
+    agent_timeout = _agent_timeout(timeout, deadline)
+    try:
+        results = await asyncio.wait_for(fused_agent_async(exception_details, deadline=deadline), timeout=agent_timeout)
+    except asyncio.TimeoutError:
+        results = _fused_error(TimeoutError(f"fused agent timed out after {agent_timeout:g}s"))
+    return results, {"fused": {"start": start, "end": time.perf_counter()}}
+
+async def _analyse_async(exception_details, mode, timeout, deadline, cache, key, exception_fingerprint):
+    started = time.perf_counter()
+    with collecting([]) as calls:
+        if mode == "fused":
+            results, timings = await _run_fused_async(exception_details, timeout, deadline)
+        else:
+            results, timings = await _run_agent_graph_async(exception_details, timeout, deadline)
+    if cache is not None and analysis_complete(results):
+        cache.set(key, results)
+    results["timings"] = _timing_summary(timings, started)
+    results["metrics"] = request_summary(calls)
+    results["mode"] = mode
+    # Set before the result is published to callers sharing it through single-flight
+    results["fingerprint"] = exception_fingerprint
+    route = _route_summary(results, mode)
+    if route is not None:
+        results["route"] = route
+    return results
+
+async def process_exception_async(exception_details, timeout=None, mode=None, deadline_seconds=None):
+    # Event-loop counterpart of process_exception for batch jobs: no threads
+    timeout = AGENT_TIMEOUT_SECONDS if timeout is None else timeout
+    mode = mode or PIPELINE_MODE
+    deadline = time.monotonic() + (EXCEPTION_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    _, exception_fingerprint = fingerprint(exception_details)
+    cache = get_result_cache()
+    key = _cache_key(exception_details, mode)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            cached["cached"] = True
+            cached["mode"] = mode
+            cached["fingerprint"] = exception_fingerprint
+            return cached
+
+    results, shared = await _inflight_async.do(
+        key, lambda: _analyse_async(exception_details, mode, timeout, deadline, cache, key, exception_fingerprint)
+    )
+    if shared:
+        results["coalesced"] = True
+    return results
+
+# Column/key names checked, in order, for the exception text in uploaded records
+EXCEPTION_FIELDS = ("exception_details", "exception", "details", "description", "message")
+
+RESULT_COLUMNS = (
+    "exception_details", "type", "priority", "complexity",
+    "suggestion", "confidence", "rationale", "explanation", "fingerprint", "cached", "seconds"
+)
+
+def _exception_text(record):
+    if isinstance(record, str):
+        return record
+    if not isinstance(record, dict):
+        return json.dumps(record)
+    for field in EXCEPTION_FIELDS:
+        if record.get(field):
+            return str(record[field])
+    return " | ".join(f"{key}: {value}" for key, value in record.items() if value)
+
+def read_exception_records(lines, file_name):
+    # Yields exception texts one at a time so large CSV/JSONL files are never parsed up front;
+    # a .json file is one document (an array of records, or a single record) and is loaded whole
+    name = file_name.lower()
+    if name.endswith(".csv"):
+        records = csv.DictReader(lines)
+    elif name.endswith(".json"):
+        document = json.load(lines)
+        records = document if isinstance(document, list) else [document]
+    else:
+        records = (line for line in lines if line.strip())
+    for record in records:
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except json.JSONDecodeError:
+                record = record.strip()
+        text = _exception_text(record)
+        if text.strip():
+            yield text
+
+def _loads_or_empty(value):
+    try:
+        data = json.loads(value)
+        return data if isinstance(data, dict) else {}
+    except (TypeError, json.JSONDecodeError):
+        return {}
+
+def flatten_result(exception_details, results):
+    classification = _loads_or_empty(results.get("classification"))
+    resolution = _loads_or_empty(results.get("resolution"))
+    return {
+        "exception_details": exception_details,
+        "type": classification.get("type", results.get("classification", "")),
+        "priority": classification.get("priority", ""),
+        "complexity": classification.get("complexity", ""),
+        "suggestion": resolution.get("suggestion", results.get("resolution", "")),
+        "confidence": resolution.get("confidence", ""),
+        "rationale": resolution.get("rationale", ""),
+        "explanation": results.get("explanation", ""),
+        "fingerprint": results.get("fingerprint", ""),
+        "cached": bool(results.get("cached")),
+        "seconds": round(results.get("timings", {}).get("total", 0.0), 3)
+    }
+
+def process_exception_batch(exceptions, concurrency=BATCH_CONCURRENCY, mode=None):
+    # Yields (index, exception_details, results) in completion order with at most
+    # `concurrency` exceptions in flight. Runs on its own pool: the agent executor
+    # is reserved for agent calls so batch work can never starve it into deadlock.
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        running = {}
+        for index, exception_details in enumerate(exceptions):
+            if len(running) >= concurrency:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield (*running.pop(future), future.result())
+            running[executor.submit(process_exception, exception_details, mode)] = (index, exception_details)
+        for future in as_completed(running):
+            yield (*running[future], future.result())
@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import re
+import string
+import sys
+import time
+from collections import Counter
+
+# Fingerprinting masks the volatile parts of an exception (ISINs, CUSIPs, trade/fund
+# IDs, dates, timestamps, amounts, numbers) and normalizes whitespace and casing, so
+# every repeat of the same break hashes to the same value.
+#
+# Only words containing a digit can need masking. Each such word is reduced to its
+# shape (digits -> 9, letters -> a) and classified once per distinct shape; shapes
+# repeat heavily in real logs, so almost every lookup is a dict hit.
+_MONTH = (
+    r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?"
+)
+_DAY = r"\d{1,2}(?:st|nd|rd|th)?"
+# Day-first ("15 Jan 2024", "15-jan-24") and month-first ("Jan 15, 2024", "January 5th 2024")
+MONTH_DATE = re.compile(rf"\b(?:{_DAY}[ -]{_MONTH},?[ -]|{_MONTH}[ -]{_DAY},?[ -])\d{{2,4}}\b")
+SHAPE = str.maketrans(string.digits + string.ascii_lowercase, "9" * 10 + "a" * 26)
+SHAPE_CLASSES = [
+    ("<timestamp>", re.compile(r"(?:9{4}-99-99a)?9{1,2}:99(?::99(?:\.9+)?)?(?:a|[+-]99:?99)?")),
+    ("<date>", re.compile(r"9{4}-99-99|9{1,2}[/.-]9{1,2}[/.-]9{2,4}|9{4}[/.]99[/.]99")),
+    ("<amount>", re.compile(r"[$€£¥]?[+-]?(?:9{1,3}(?:,999)+|9+)\.9+%?|[$€£¥][+-]?9[9,]*|[+-]?9{1,3}(?:,999)+|[+-]9+|9+%")),
+    ("<isin>", re.compile(r"aa[a9]{9}9")),
+    ("<cusip>", re.compile(r"999[a9]{5}9")),
+    ("<num>", re.compile(r"9+")),
+]
+# Leading/trailing punctuation is kept around the placeholder: "(cusip" stays readable
+_WORD = re.compile(r"([^\w$€£¥+-]*)(.*?)([^\w%]*)")
+_MAX_SHAPES = 100000
+
+_shapes = {}
+
+
+def _classify(shape):
+    lead, core, trail = _WORD.fullmatch(shape).groups()
+    for token, pattern in SHAPE_CLASSES:
+        if pattern.fullmatch(core):
+            return lead + token + trail
+    return lead + "<id>" + trail
+
+
+def _mask_shape(shape):
+    masked = _shapes.get(shape)
+    if masked is None:
+        if len(_shapes) >= _MAX_SHAPES:
+            _shapes.clear()
+        masked = _shapes[shape] = _classify(shape)
+    return masked
+
+
+def _mask_line(line, shape_line):
+    return " ".join([
+        _mask_shape(shape) if "9" in shape else word
+        for word, shape in zip(line.split(), shape_line.split())
+    ])
+
+
+def _digest(masked):
+    return hashlib.blake2b(masked.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def fingerprint(exception_details):
+    # Returns (masked_text, hash) for one exception
+    text = MONTH_DATE.sub("<date>", exception_details.lower())
+    masked = _mask_line(text, text.translate(SHAPE))
+    return masked, _digest(masked)
+
+
+def fingerprint_many(lines):
+    # Batch mode: lowercasing, date and shape passes run once over the joined block
+    if not lines:
+        return []
+    text = MONTH_DATE.sub("<date>", "\n".join(line.replace("\n", " ") for line in lines).lower())
+    results = []
+    for line, shape_line in zip(text.split("\n"), text.translate(SHAPE).split("\n")):
+        masked = _mask_line(line, shape_line)
+        results.append((masked, _digest(masked)))
+    return results
+
+
+def _count(chunk, counts, examples):
+    for masked, digest in fingerprint_many(chunk):
+        counts[digest] += 1
+        examples.setdefault(digest, masked)
+    return len(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Group exception log lines by fingerprint.")
+    parser.add_argument("input", nargs="?", default="-", help="log file, one exception per line (default: stdin)")
+    parser.add_argument("--top", type=int, default=20, help="number of patterns to print")
+    parser.add_argument("--chunk", type=int, default=10000, help="lines fingerprinted per batch")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", errors="replace")
+    counts = Counter()
+    examples = {}
+    total = 0
+    started = time.perf_counter()
+    with source:
+        chunk = []
+        for line in source:
+            chunk.append(line.rstrip("\r\n"))
+            if len(chunk) >= args.chunk:
+                total += _count(chunk, counts, examples)
+                chunk = []
+        total += _count(chunk, counts, examples)
+    elapsed = time.perf_counter() - started
+
+    for digest, count in counts.most_common(args.top):
+        print(f"{digest}\t{count}\t{examples[digest]}")
+    print(f"{total} lines, {len(counts)} fingerprints, {total / max(elapsed, 1e-9):,.0f} lines/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from benchmark import BENCHMARK_ENV, Sampler, exceptions, git_commit, rss_mb, start_mock
+
+# The release shared_runtime() was written against; see requirements-loadtest.txt
+STREAMLIT_VERSION = "1.65.0"
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+STEPS = ("open", "input", "process", "approve")
+
+
+@contextmanager
+def shared_runtime():
+    # AppTest installs a mock Runtime singleton for each run and clears it when the run
+    # ends, so concurrent sessions pull it out from under each other. For the duration
+    # of the load test, one shared mock is pinned and AppTest's set/clear goes to a
+    # subclass nobody reads; the appTest config flag is likewise held for the whole run.
+    # The script is also compiled once and shared, as the real server does: AppTest
+    # recompiles it every run, and concurrent ast.parse calls are not thread-safe.
+    # These are private AppTest internals, so main() refuses other Streamlit releases.
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = app_test.MediaFileManager(app_test.MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = app_test.DataframeSourceManager()
+    runtime.cache_storage_manager = app_test.MemoryCacheStorageManager()
+    runtime.bidi_component_registry = app_test.BidiComponentManager()
+    runtime.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+    script_cache = app_test.ScriptCache()
+    app_test.Runtime = type("PerRunRuntime", (Runtime,), {})
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+    Runtime._instance = runtime
+    try:
+        with app_test.patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        app_test.Runtime = Runtime
+        app_test.ScriptCache = local_script_runner.ScriptCache = type(script_cache)
+        Runtime._instance = None
+
+
+class Session:
+    # One simulated operator: opens the app, then pastes, processes and approves
+    # exceptions with a think time between interactions. Every rerun is timed.
+    def __init__(self, texts, think_seconds, timeout, seed):
+        self.texts = texts
+        self.think_seconds = think_seconds
+        self.timeout = timeout
+        self.app = None
+        self.timings = {step: [] for step in STEPS}
+        self.errors = []
+        self._random = random.Random(seed)
+
+    def _rerun(self, step, action):
+        started = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            self.errors.append(f"{step}: {type(e).__name__}: {e}")
+            return False
+        self.timings[step].append(time.perf_counter() - started)
+        if self.app.exception:
+            self.errors.extend(f"{step}: {exception.message}" for exception in self.app.exception)
+            return False
+        return True
+
+    def _think(self):
+        if self.think_seconds:
+            time.sleep(self._random.expovariate(1 / self.think_seconds))
+
+    def _button(self, label):
+        return next(button for button in self.app.button if label in button.label)
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        self.app = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        if not self._rerun("open", self.app.run):
+            return self
+        for text in self.texts:
+            self._think()
+            if not self._rerun("input", lambda: self.app.text_area[0].input(text).run()):
+                return self
+            if not self._rerun("process", lambda: self._button("Process Exception").click().run()):
+                return self
+            self._think()
+            if not self._rerun("approve", lambda: self.app.button(key="approve_btn").click().run()):
+                return self
+        return self
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return None
+    values = np.array(seconds) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1),
+            "max": round(float(values.max()), 1)}
+
+
+def run(sessions, iterations, ramp_seconds, think_seconds, timeout):
+    # Sessions start evenly over ramp_seconds and stay referenced until the end, like
+    # open browser tabs, so the memory they hold is part of the measurement
+    texts = exceptions(sessions * iterations, seed=1)
+    users = [
+        Session(texts[i * iterations:(i + 1) * iterations], think_seconds, timeout, seed=i)
+        for i in range(sessions)
+    ]
+    threads_before, rss_before = threading.active_count(), rss_mb()
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+
+    def start(index):
+        time.sleep(index * ramp_seconds / sessions)
+        return users[index].run()
+
+    with Sampler(interval=0.1) as sampler:
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(start, range(sessions)))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    rss_after = rss_mb()
+    reruns = sum(len(user.timings[step]) for user in users for step in STEPS)
+    errors = [error for user in users for error in user.errors]
+    return {
+        "sessions": sessions,
+        "iterations": iterations,
+        "elapsed_seconds": round(elapsed, 2),
+        "reruns": reruns,
+        "failed_sessions": sum(bool(user.errors) for user in users),
+        "errors": errors[:20],
+        "rerun_latency_ms": {step: _percentiles([t for user in users for t in user.timings[step]]) for step in STEPS},
+        "cpu": {
+            "seconds": round(cpu, 2),
+            "utilisation": round(cpu / elapsed, 3),
+            "ms_per_rerun": round(cpu / reruns * 1000, 2) if reruns else None,
+        },
+        "threads": {"before": threads_before, "peak": max(sampler.threads, default=threads_before),
+                    "after": threading.active_count()},
+        "rss_mb": {
+            "before": round(rss_before, 1),
+            "peak": round(max(sampler.rss, default=rss_before), 1),
+            "after": round(rss_after, 1),
+            "per_session": round((rss_after - rss_before) / sessions, 2),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive many simulated Streamlit sessions against the local OpenAI stand-in.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 50], help="concurrent operators per run")
+    parser.add_argument("--iterations", type=int, default=3, help="exceptions each operator processes")
+    parser.add_argument("--ramp-seconds", type=float, default=10.0, help="time over which sessions start")
+    parser.add_argument("--think-seconds", type=float, default=2.0, help="mean pause between interactions")
+    parser.add_argument("--timeout", type=float, default=180.0, help="longest a single rerun may take")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="median mock response latency")
+    parser.add_argument("--sigma", type=float, default=0.3)
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--base-url", help="use an already running stand-in instead of starting one")
+    parser.add_argument("--output", default="loadtest.json")
+    args = parser.parse_args(argv)
+
+    import streamlit
+
+    if streamlit.__version__ != STREAMLIT_VERSION:
+        parser.exit(1, f"loadtest.py patches Streamlit {STREAMLIT_VERSION} internals but {streamlit.__version__} is "
+                       f"installed; pip install -r requirements-loadtest.txt\n")
+    for name, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(name, value)
+    mock = None
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    else:
+        mock, os.environ["OPENAI_BASE_URL"] = start_mock(args)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "mock": {"base_url": os.environ["OPENAI_BASE_URL"], "latency_ms": args.latency_ms,
+                     "sigma": args.sigma, "token_ms": args.token_ms, "error_rate": args.error_rate},
+            "think_seconds": args.think_seconds,
+            "ramp_seconds": args.ramp_seconds,
+            "env": {name: os.environ[name] for name in sorted(BENCHMARK_ENV) if name != "OPENAI_API_KEY"},
+        },
+        "runs": [],
+    }
+    try:
+        with shared_runtime():
+            # One warm-up session so imports and first-use singletons are not billed to the first run
+            Session(exceptions(1, seed=2), 0, args.timeout, seed=0).run()
+            for sessions in args.sessions:
+                result = run(sessions, args.iterations, args.ramp_seconds, args.think_seconds, args.timeout)
+                report["runs"].append(result)
+                process = result["rerun_latency_ms"]["process"] or {"p50": float("nan"), "p95": float("nan")}
+                print(f"sessions={sessions:<4} process p50={process['p50']:.0f}ms p95={process['p95']:.0f}ms  "
+                      f"cpu={result['cpu']['utilisation']:.0%}  threads={result['threads']['peak']}  "
+                      f"rss={result['rss_mb']['peak']:.0f}MB ({result['rss_mb']['per_session']:.1f}MB/session)  "
+                      f"failed={result['failed_sessions']}")
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return 1 if any(result["failed_sessions"] for result in report["runs"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
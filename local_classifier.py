@@ -0,0 +1,285 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from case_history import DEFAULT_PATH as CASE_HISTORY_PATH, approved_classifications
+from embeddings import HashingEmbedder
+from fingerprint import fingerprint_many
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("type", "priority", "complexity")
+FEATURE_DIMENSIONS = 4096
+DEFAULT_MODEL_PATH = "local_classifier.npz"
+DEFAULT_RULES_PATH = "local_classifier_rules.json"
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_HOLDOUT = 0.2
+# A retrained model is only swapped in when its locally-answered holdout predictions are at least this accurate
+DEFAULT_MIN_PRECISION = 0.95
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class LogisticModel:
+    # One softmax-regression head per classification field over signed hashed
+    # unigrams and bigrams of the fingerprint-masked exception text
+    def __init__(self, dimensions=FEATURE_DIMENSIONS):
+        self.dimensions = dimensions
+        self.embedder = HashingEmbedder(dimensions)
+        self.classes = {}
+        self.weights = {}
+
+    def features(self, texts):
+        features = self.embedder.embed([masked for masked, _ in fingerprint_many(texts)])
+        return np.hstack([features, np.ones((len(features), 1), dtype=np.float32)])
+
+    def fit(self, texts, labels, epochs=100, learning_rate=10.0, l2=1e-4):
+        # labels: one {"type", "priority", "complexity"} dict per text; full-batch gradient descent
+        features = self.features(texts)
+        for field in FIELDS:
+            classes = sorted({label[field] for label in labels})
+            index = {name: i for i, name in enumerate(classes)}
+            targets = np.zeros((len(labels), len(classes)), dtype=np.float32)
+            targets[np.arange(len(labels)), [index[label[field]] for label in labels]] = 1.0
+            weights = np.zeros((features.shape[1], len(classes)), dtype=np.float32)
+            for _ in range(epochs):
+                gradient = features.T @ (_softmax(features @ weights) - targets) / len(labels)
+                weights -= learning_rate * (gradient + l2 * weights)
+            self.classes[field] = classes
+            self.weights[field] = weights
+        return self
+
+    def predict(self, texts):
+        # Returns one (labels, confidence) per text; confidence is the weakest field's probability
+        features = self.features(texts)
+        labels = [{} for _ in texts]
+        confidence = np.ones(len(texts))
+        for field in FIELDS:
+            probabilities = _softmax(features @ self.weights[field])
+            best = probabilities.argmax(axis=1)
+            confidence = np.minimum(confidence, probabilities[np.arange(len(texts)), best])
+            for row, label in zip(labels, best.tolist()):
+                row[field] = self.classes[field][label]
+        return list(zip(labels, confidence.tolist()))
+
+    def save(self, path):
+        # Written to a temporary file and renamed, so a reader never loads half a model
+        arrays = {f"weights_{field}": self.weights[field] for field in FIELDS}
+        arrays.update({f"classes_{field}": np.array(self.classes[field]) for field in FIELDS})
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, dimensions=self.dimensions, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = cls(int(data["dimensions"]))
+            for field in FIELDS:
+                model.weights[field] = data[f"weights_{field}"]
+                model.classes[field] = data[f"classes_{field}"].tolist()
+        return model
+
+
+def load_rules(path):
+    # JSON list of {"pattern": regex, "type": ..., "priority": ..., "complexity": ...},
+    # matched case-insensitively against the raw exception text in order
+    with open(path, encoding="utf-8") as f:
+        return [
+            (re.compile(rule["pattern"], re.IGNORECASE), {field: rule[field] for field in FIELDS})
+            for rule in json.load(f)
+        ]
+
+
+class FastPath:
+    # Answers classification locally when a rule matches or the model is confident
+    # enough, and keeps the counts and latencies behind the escalation rate. With a
+    # model_path, a model file swapped in by the training job is picked up on the next call.
+    def __init__(self, model=None, rules=(), threshold=DEFAULT_THRESHOLD, model_path=None):
+        self.model = model
+        self.rules = list(rules)
+        self.threshold = threshold
+        self.model_path = model_path
+        self._model_version = None
+        self._lock = threading.Lock()
+        self._counts = {"local": 0, "escalated": 0}
+        self._seconds = {"local": 0.0, "escalated": 0.0}
+
+    def _record(self, outcome, seconds):
+        with self._lock:
+            self._counts[outcome] += 1
+            self._seconds[outcome] += seconds
+
+    def _reload_model(self):
+        # A file that fails to load is remembered by version and not retried until it changes;
+        # until then the previous model (or none, so every call escalates) stays in use
+        try:
+            stat = os.stat(self.model_path)
+        except FileNotFoundError:
+            return
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._model_version:
+            self._model_version = version
+            try:
+                self.model = LogisticModel.load(self.model_path)
+            except Exception as e:
+                logger.error("Could not load local classifier model %s, keeping the previous one: %s", self.model_path, e)
+
+    def classify(self, exception_details):
+        # Returns classification JSON, or None when the call should escalate to the LLM
+        started = time.perf_counter()
+        if self.model_path:
+            self._reload_model()
+        result = None
+        for pattern, labels in self.rules:
+            if pattern.search(exception_details):
+                result = dict(labels, fast_path={"source": "rules", "confidence": 1.0})
+                break
+        if result is None and self.model is not None:
+            labels, confidence = self.model.predict([exception_details])[0]
+            if confidence >= self.threshold:
+                result = dict(labels, fast_path={"source": "model", "confidence": round(confidence, 4)})
+        if result is None:
+            return None
+        self._record("local", time.perf_counter() - started)
+        return json.dumps(result)
+
+    def record_escalation(self, seconds):
+        self._record("escalated", seconds)
+
+    def stats(self):
+        with self._lock:
+            total = sum(self._counts.values())
+            return {
+                "local": self._counts["local"],
+                "escalated": self._counts["escalated"],
+                "escalation_rate": self._counts["escalated"] / total if total else None,
+                "local_latency": self._seconds["local"] / self._counts["local"] if self._counts["local"] else None,
+                "llm_latency": self._seconds["escalated"] / self._counts["escalated"] if self._counts["escalated"] else None,
+            }
+
+
+_fast_path = None
+_fast_path_lock = threading.Lock()
+
+
+def get_fast_path():
+    # None when disabled; rules and model files are optional, without either every call escalates
+    global _fast_path
+    if os.getenv("LOCAL_CLASSIFIER_ENABLED", "1") == "0":
+        return None
+    with _fast_path_lock:
+        if _fast_path is None:
+            rules_path = os.getenv("LOCAL_CLASSIFIER_RULES", DEFAULT_RULES_PATH)
+            rules = ()
+            if os.path.exists(rules_path):
+                try:
+                    rules = load_rules(rules_path)
+                except Exception as e:
+                    # Loaded once per process: a broken rules file means no rules, not a failure per call
+                    logger.error("Could not load local classifier rules %s, running without them: %s", rules_path, e)
+            _fast_path = FastPath(
+                rules=rules,
+                threshold=_threshold(),
+                model_path=os.getenv("LOCAL_CLASSIFIER_PATH", DEFAULT_MODEL_PATH),
+            )
+        return _fast_path
+
+
+def _threshold():
+    return float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", DEFAULT_THRESHOLD))
+
+
+def harvest(path=CASE_HISTORY_PATH):
+    # Operator-approved LLM classifications; error payloads and answers the fast
+    # path produced itself are skipped so the model never trains on its own output
+    texts, labels = [], []
+    for exception_details, classification in approved_classifications(path):
+        try:
+            data = json.loads(classification)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(data, dict) or "fast_path" in data:
+            continue
+        if not all(isinstance(data.get(field), str) and data[field] for field in FIELDS):
+            continue
+        if data["type"].startswith("Error"):
+            continue
+        texts.append(exception_details)
+        labels.append({field: data[field].strip() for field in FIELDS})
+    return texts, labels
+
+
+def split_holdout(texts, labels, fraction):
+    # The newest approvals are held out: train on the past, score on what came next
+    cut = len(texts) - int(len(texts) * fraction)
+    return (texts[:cut], labels[:cut]), (texts[cut:], labels[cut:])
+
+
+def evaluate(model, texts, labels, threshold):
+    # Per-field accuracy over the holdout, plus the coverage and precision of the
+    # predictions confident enough for the fast path to answer
+    if not texts:
+        return {"count": 0}
+    predictions = model.predict(texts)
+    correct = np.array([[predicted[field] == label[field] for field in FIELDS] for (predicted, _), label in zip(predictions, labels)])
+    confident = np.array([confidence >= threshold for _, confidence in predictions])
+    exact = correct.all(axis=1)
+    return {
+        "count": len(texts),
+        "accuracy": {field: float(correct[:, i].mean()) for i, field in enumerate(FIELDS)},
+        "coverage": float(confident.mean()),
+        "precision": float(exact[confident].mean()) if confident.any() else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retrain the local classifier from approved classifications.")
+    parser.add_argument("--history", default=os.getenv("CASE_HISTORY_PATH", CASE_HISTORY_PATH))
+    parser.add_argument("--output", default=os.getenv("LOCAL_CLASSIFIER_PATH", DEFAULT_MODEL_PATH))
+    parser.add_argument("--holdout", type=float, default=DEFAULT_HOLDOUT)
+    parser.add_argument("--min-precision", type=float, default=DEFAULT_MIN_PRECISION)
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--force", action="store_true", help="swap the model in even if it does not beat the current one")
+    args = parser.parse_args(argv)
+
+    texts, labels = harvest(args.history)
+    (train_texts, train_labels), (holdout_texts, holdout_labels) = split_holdout(texts, labels, args.holdout)
+    if not train_texts:
+        parser.exit(1, f"No approved classifications to train on in {args.history}\n")
+    threshold = _threshold()
+    started = time.perf_counter()
+    model = LogisticModel().fit(train_texts, train_labels, epochs=args.epochs)
+    report = {
+        "train": len(train_texts),
+        "training_seconds": round(time.perf_counter() - started, 2),
+        "threshold": threshold,
+        "candidate": evaluate(model, holdout_texts, holdout_labels, threshold),
+    }
+    if os.path.exists(args.output):
+        report["current"] = evaluate(LogisticModel.load(args.output), holdout_texts, holdout_labels, threshold)
+
+    precision = report["candidate"].get("precision")
+    current = report.get("current", {}).get("precision")
+    accepted = args.force or (
+        precision is not None and precision >= args.min_precision and (current is None or precision >= current)
+    )
+    if accepted:
+        model.save(args.output)
+    report["swapped"] = accepted
+    print(json.dumps(report, indent=2))
+    if not accepted:
+        parser.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import contextvars
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# USD per 1K prompt / completion tokens; override or extend with MODEL_PRICES (see configured_prices)
+DEFAULT_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+
+def configured_prices():
+    # DEFAULT_PRICES plus MODEL_PRICES overrides, e.g. '{"gpt-4o": [0.0025, 0.01]}'
+    overrides = json.loads(os.getenv("MODEL_PRICES", "{}"))
+    return dict(DEFAULT_PRICES, **{model: tuple(price) for model, price in overrides.items()})
+
+
+def usage_cost(model, usage, prices=DEFAULT_PRICES):
+    # USD for one call from its usage (prompt_tokens / completion_tokens); unknown models cost 0
+    prompt_price, completion_price = prices.get(model, (0.0, 0.0))
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+# Recent latencies kept per agent/model/route for percentiles; totals cover every call
+LATENCY_WINDOW = 1000
+
+_request_calls = contextvars.ContextVar("request_calls", default=None)
+
+
+@contextmanager
+def collecting(calls):
+    # Calls recorded inside the block, and in asyncio tasks started from it, are also
+    # appended to `calls`. Threads do not inherit it: pass request_calls() across explicitly.
+    token = _request_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _request_calls.reset(token)
+
+
+def request_calls():
+    return _request_calls.get()
+
+
+def request_summary(calls):
+    # Totals over one request's calls, with the calls themselves, for results["metrics"]
+    return {
+        "calls": list(calls),
+        "llm_seconds": round(sum(call["seconds"] for call in calls), 4),
+        "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+        "completion_tokens": sum(call["completion_tokens"] for call in calls),
+        "retries": sum(call["retries"] for call in calls),
+        "cost": round(sum(call["cost"] for call in calls), 6),
+    }
+
+
+class MetricsRegistry:
+    # Process-wide latency, token, retry and cost totals for every LLM call, by agent,
+    # model and, when model routing is on, the route that picked the model
+    def __init__(self, prices=None, window=LATENCY_WINDOW):
+        self.prices = configured_prices() if prices is None else prices
+        self.window = window
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, agent, model, seconds, usage, retries=0, error=None, route=None):
+        # Returns the call's record; it is also appended to the current request's calls, if any
+        call = {
+            "agent": agent,
+            "model": model,
+            "seconds": round(seconds, 4),
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "retries": retries,
+            "cost": usage_cost(model, usage, self.prices),
+        }
+        if route is not None:
+            call["route"] = route
+        if error is not None:
+            call["error"] = error
+        with self._lock:
+            entry = self._entries.get((agent, model, route or ""))
+            if entry is None:
+                entry = self._entries[(agent, model, route or "")] = {
+                    "calls": 0, "errors": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                    "cost": 0.0, "seconds": 0.0, "latencies": deque(maxlen=self.window),
+                }
+            entry["calls"] += 1
+            entry["errors"] += error is not None
+            entry["retries"] += retries
+            entry["prompt_tokens"] += call["prompt_tokens"]
+            entry["completion_tokens"] += call["completion_tokens"]
+            entry["cost"] += call["cost"]
+            entry["seconds"] += seconds
+            entry["latencies"].append(seconds)
+        calls = _request_calls.get()
+        if calls is not None:
+            calls.append(call)
+        return call
+
+    def stats(self):
+        with self._lock:
+            entries = [(key, dict(entry, latencies=list(entry["latencies"]))) for key, entry in sorted(self._entries.items())]
+        stats = []
+        for (agent, model, route), entry in entries:
+            p50, p95 = np.percentile(entry.pop("latencies"), [50, 95])
+            stats.append(dict(
+                agent=agent, model=model, route=route or None, avg_seconds=entry["seconds"] / entry["calls"],
+                p50_seconds=float(p50), p95_seconds=float(p95), **entry,
+            ))
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+        return _metrics
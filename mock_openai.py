@@ -0,0 +1,207 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from embeddings import HashingEmbedder
+
+# Canned answers keyed by a phrase from each agent's system prompt
+RESPONSES = {
+    "classification expert": json.dumps({"type": "Pricing Discrepancy", "priority": "High", "complexity": "Low"}),
+    "resolution suggestion expert": json.dumps({
+        "suggestion": "Re-pull the vendor price and re-run the NAV strike for the affected fund",
+        "confidence": "85%",
+        "rationale": "The break matches a stale-price pattern that clears once the price is refreshed",
+    }),
+    "explanation expert": (
+        "The fund's price for this security did not match the vendor feed. Refreshing the price from "
+        "the vendor and re-running the NAV calculation should clear the break; no manual adjustment is needed."
+    ),
+    "exception management expert": json.dumps({
+        "classification": {"type": "Pricing Discrepancy", "priority": "High", "complexity": "Low"},
+        "resolution": {
+            "suggestion": "Re-pull the vendor price and re-run the NAV strike for the affected fund",
+            "confidence": "85%",
+            "rationale": "The break matches a stale-price pattern that clears once the price is refreshed",
+        },
+        "explanation": "The price did not match the vendor feed; refreshing it and re-running the NAV should clear the break.",
+    }),
+}
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class MockBehaviour:
+    # Latency is lognormal around latency_ms (sigma 0 = fixed); a share of requests
+    # fails with one of error_statuses, and timeout_rate of them hang for hang_seconds
+    def __init__(self, latency_ms=800.0, sigma=0.3, token_ms=15.0, error_rate=0.0,
+                 error_statuses=(429, 500, 503), timeout_rate=0.0, hang_seconds=600.0, seed=None):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.token_ms = token_ms
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0, "timeouts": 0}
+
+    def draw(self):
+        # Returns (delay seconds, error status or None, hang)
+        with self._lock:
+            self.counts["requests"] += 1
+            roll = self._random.random()
+            delay = self.latency_ms / 1000 * (self._random.lognormvariate(0, self.sigma) if self.sigma else 1.0)
+            if roll < self.timeout_rate:
+                self.counts["timeouts"] += 1
+                return delay, None, True
+            if roll < self.timeout_rate + self.error_rate:
+                self.counts["errors"] += 1
+                return delay, self._random.choice(self.error_statuses), False
+            return delay, None, False
+
+
+def _answer(messages):
+    system = (messages[0].get("content") or "") if messages else ""
+    for phrase, content in RESPONSES.items():
+        if phrase in system:
+            return content
+    return "OK"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    behaviour = MockBehaviour()
+    embedder = HashingEmbedder(1536)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        delay, error, hang = self.behaviour.draw()
+        if hang:
+            time.sleep(self.behaviour.hang_seconds)
+            return
+        time.sleep(delay)
+        if error:
+            headers = {"Retry-After": "1"} if error == 429 else None
+            self._send_json(error, {"error": {"message": f"Injected {error}", "type": "mock_error", "code": str(error)}}, headers)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self._chat(request)
+        elif self.path.rstrip("/").endswith("/embeddings"):
+            self._embeddings(request)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _usage(self, request, content):
+        prompt = sum(_count_tokens(message.get("content") or "") for message in request.get("messages", []))
+        completion = _count_tokens(content)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def _chat(self, request):
+        content = _answer(request.get("messages", []))
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = request.get("model", "gpt-4")
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": self._usage(request, content),
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send(choices, usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": choices, "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i, word in enumerate(content.split(" ")):
+            send([{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}])
+            time.sleep(self.behaviour.token_ms / 1000)
+        send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send([], self._usage(request, content))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, request):
+        texts = request.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        vectors = self.embedder.embed(texts)
+        tokens = sum(_count_tokens(text) for text in texts)
+        self._send_json(200, {
+            "object": "list", "model": request.get("model"),
+            "data": [{"object": "embedding", "index": i, "embedding": np.round(vector, 6).tolist()}
+                     for i, vector in enumerate(vectors)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 refuses connections once a load test opens dozens at once
+    request_queue_size = 256
+
+
+def serve(host="127.0.0.1", port=8000, behaviour=None):
+    # Returns a started server; point the app at it with OPENAI_BASE_URL=http://host:port/v1
+    handler = type("Handler", (MockHandler,), {"behaviour": behaviour or MockBehaviour()})
+    server = MockServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions and embeddings API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="median response latency")
+    parser.add_argument("--sigma", type=float, default=0.3, help="lognormal spread of the latency (0 = fixed)")
+    parser.add_argument("--token-ms", type=float, default=15.0, help="delay between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with an error status")
+    parser.add_argument("--error-status", type=int, nargs="+", default=[429, 500, 503])
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="share of requests that never answer")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    behaviour = MockBehaviour(
+        latency_ms=args.latency_ms, sigma=args.sigma, token_ms=args.token_ms, error_rate=args.error_rate,
+        error_statuses=args.error_status, timeout_rate=args.timeout_rate, seed=args.seed,
+    )
+    server = serve(args.host, args.port, behaviour)
+    print(f"Mock OpenAI API on http://{args.host}:{server.server_port}/v1 (Ctrl+C to stop)", flush=True)
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(behaviour.counts), flush=True)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def default_routes(model):
+    # Classification runs on the small model; its complexity and priority then pick the
+    # model for resolution and explanation. Rules are tried in order, first match wins.
+    return {
+        "classification": "gpt-4o-mini",
+        "fused": model,
+        "routes": [
+            {"name": "complex", "when": {"complexity": ["high"]},
+             "resolution": model, "explanation": "gpt-4o-mini"},
+            {"name": "routine", "when": {"complexity": ["low"], "priority": ["low", "medium"]},
+             "resolution": "gpt-4o-mini", "explanation": "gpt-4o-mini"},
+        ],
+        "default": {"name": "default", "resolution": model, "explanation": model},
+    }
+
+
+def _matches(when, classification):
+    # Each field must start with one of its listed values, ignoring case ("Low - quick fix" matches "low")
+    return all(
+        any(str(classification.get(field, "")).strip().lower().startswith(option.lower()) for option in options)
+        for field, options in when.items()
+    )
+
+
+class ModelRouter:
+    # Picks a model per agent from the routing table; each call's route is recorded
+    # with its latency, tokens and cost in the metrics registry
+    def __init__(self, table):
+        self.table = table
+        # Part of the result cache key: a new table must not serve answers from the old one
+        self.signature = hashlib.sha256(json.dumps(table, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def classification_model(self):
+        return self.table["classification"]
+
+    @property
+    def fused_model(self):
+        return self.table["fused"]
+
+    def route(self, classification):
+        # classification: JSON string (or None when it failed); returns the matching route entry
+        try:
+            data = json.loads(classification) if classification else {}
+        except (TypeError, json.JSONDecodeError):
+            data = {}
+        if isinstance(data, dict) and not str(data.get("type", "")).startswith("Error"):
+            for route in self.table["routes"]:
+                if _matches(route["when"], data):
+                    return route
+        return self.table["default"]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    # None unless MODEL_ROUTING=1; MODEL_ROUTES points at a JSON routing table shaped like default_routes()
+    global _router
+    if os.getenv("MODEL_ROUTING", "0") != "1":
+        return None
+    with _router_lock:
+        if _router is None:
+            table = default_routes(os.getenv("OPENAI_MODEL", "gpt-4"))
+            path = os.getenv("MODEL_ROUTES")
+            if path:
+                with open(path, encoding="utf-8") as f:
+                    table.update(json.load(f))
+            _router = ModelRouter(table)
+        return _router
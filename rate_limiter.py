@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+# Conservative defaults (OpenAI tier-1 GPT-4); raise them to match your organisation's quota
+DEFAULT_RPM = 500
+DEFAULT_TPM = 10000
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def utilization(self):
+        return 1.0 - self.level / self.capacity
+
+
+def estimate_tokens(messages, max_tokens):
+    # Roughly four characters per token for the prompt, plus the completion budget
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 4 + (max_tokens or 0)
+
+
+class RateLimiter:
+    # Requests-per-minute and tokens-per-minute buckets per model. Callers that
+    # would exceed either bucket wait for it to refill instead of drawing a 429.
+    def __init__(self, limits=None, default_rpm=DEFAULT_RPM, default_tpm=DEFAULT_TPM):
+        self.limits = limits or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self._buckets = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def _model_buckets(self, model):
+        if model not in self._buckets:
+            limit = self.limits.get(model, {})
+            self._buckets[model] = (
+                TokenBucket(limit.get("rpm", self.default_rpm)),
+                TokenBucket(limit.get("tpm", self.default_tpm)),
+            )
+        return self._buckets[model]
+
+    def _try_acquire(self, model, tokens):
+        # Returns 0 once both buckets have been charged, else the seconds to wait
+        with self._lock:
+            requests, token_bucket = self._model_buckets(model)
+            tokens = min(tokens, token_bucket.capacity)
+            now = time.monotonic()
+            requests.refill(now)
+            token_bucket.refill(now)
+            delay = max(requests.wait_time(1), token_bucket.wait_time(tokens))
+            if delay == 0:
+                requests.level -= 1
+                token_bucket.level -= tokens
+            return delay
+
+    def _set_waiting(self, model, change):
+        with self._lock:
+            self._waiting[model] = self._waiting.get(model, 0) + change
+
+    def acquire(self, model, tokens, deadline=None):
+        delay = self._try_acquire(model, tokens)
+        if not delay:
+            return
+        self._set_waiting(model, 1)
+        try:
+            while delay:
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise TimeoutError(f"Rate limit wait for {model} would pass the deadline")
+                time.sleep(delay)
+                delay = self._try_acquire(model, tokens)
+        finally:
+            self._set_waiting(model, -1)
+
+    async def acquire_async(self, model, tokens, deadline=None):
+        delay = self._try_acquire(model, tokens)
+        if not delay:
+            return
+        self._set_waiting(model, 1)
+        try:
+            while delay:
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise TimeoutError(f"Rate limit wait for {model} would pass the deadline")
+                await asyncio.sleep(delay)
+                delay = self._try_acquire(model, tokens)
+        finally:
+            self._set_waiting(model, -1)
+
+    def reconcile(self, model, estimated, actual):
+        # Refund (or charge) the difference once the response reports real usage
+        if actual is None:
+            return
+        with self._lock:
+            _, token_bucket = self._model_buckets(model)
+            token_bucket.level = min(token_bucket.capacity, token_bucket.level + estimated - actual)
+
+    def utilization(self):
+        with self._lock:
+            now = time.monotonic()
+            report = {}
+            for model, (requests, token_bucket) in self._buckets.items():
+                requests.refill(now)
+                token_bucket.refill(now)
+                report[model] = {
+                    "rpm": requests.utilization(),
+                    "tpm": token_bucket.utilization(),
+                    "waiting": self._waiting.get(model, 0),
+                }
+            return report
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    # Process-wide limiter; per-model overrides come from OPENAI_RATE_LIMITS,
+    # e.g. '{"gpt-4": {"rpm": 10000, "tpm": 300000}}'
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                limits=json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}")),
+                default_rpm=float(os.getenv("OPENAI_RPM_LIMIT", DEFAULT_RPM)),
+                default_tpm=float(os.getenv("OPENAI_TPM_LIMIT", DEFAULT_TPM)),
+            )
+        return _limiter
@@ -0,0 +1,72 @@
+import os
+import random
+import time
+
+import openai
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+
+# Transient failures only: bad requests, auth and content errors fail immediately
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def remaining(deadline):
+    # Seconds left before a time.monotonic() deadline, or None when unbounded
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, attempt, error, deadline=None):
+        # Seconds to sleep before retry number `attempt + 1`, or None to give up
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        # Full jitter keeps a burst of 429s from retrying in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        delay = max(delay, _retry_after(error) or 0.0)
+        left = remaining(deadline)
+        if left is not None and delay >= left:
+            return None
+        return delay
+
+
+_policy = None
+
+
+def get_retry_policy():
+    global _policy
+    if _policy is None:
+        _policy = RetryPolicy(
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+            base_delay=float(os.getenv("OPENAI_RETRY_BASE_SECONDS", DEFAULT_BASE_DELAY)),
+            max_delay=float(os.getenv("OPENAI_RETRY_MAX_SECONDS", DEFAULT_MAX_DELAY)),
+        )
+    return _policy
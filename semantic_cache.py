@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from embeddings import get_embedder
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_MAX_ENTRIES = 50000
+
+
+class SemanticCache:
+    # Nearest-neighbour cache of resolutions over exception embeddings. Vectors live
+    # in one preallocated matrix (grown by doubling) so a lookup is a single matvec;
+    # once full, the oldest entries are overwritten.
+    def __init__(self, embedder, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._vectors = None
+        self._entries = []
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def embed(self, exception_details):
+        return self.embedder.embed([exception_details])[0]
+
+    def lookup(self, vector):
+        # Returns (similarity, exception_details, resolution) for the best match above the threshold
+        with self._lock:
+            if not self._entries:
+                return None
+            scores = self._vectors[:len(self._entries)] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return (float(scores[best]), *self._entries[best])
+
+    def add(self, vector, exception_details, resolution, replace=False):
+        # replace overwrites the entry a lookup of this vector would return, so a
+        # reprocessed answer supersedes the stale one instead of sitting behind it
+        with self._lock:
+            if replace and self._entries:
+                scores = self._vectors[:len(self._entries)] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries[best] = (exception_details, resolution)
+                    self._vectors[best] = vector
+                    return
+            if self._vectors is None:
+                self._vectors = np.zeros((min(1024, self.max_entries), len(vector)), dtype=np.float32)
+            if len(self._entries) < self.max_entries:
+                if len(self._entries) == len(self._vectors):
+                    grown = np.zeros((min(len(self._vectors) * 2, self.max_entries), len(vector)), dtype=np.float32)
+                    grown[:len(self._vectors)] = self._vectors
+                    self._vectors = grown
+                slot = len(self._entries)
+                self._entries.append((exception_details, resolution))
+            else:
+                slot = self._next
+                self._next = (self._next + 1) % self.max_entries
+                self._entries[slot] = (exception_details, resolution)
+            self._vectors[slot] = vector
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def mark_hit(hit):
+    # Reused resolution JSON plus a marker telling the operator where it came from
+    similarity, matched, resolution = hit
+    data = json.loads(resolution)
+    data["cache_hit"] = {"similarity": round(similarity, 4), "matched_exception": matched}
+    return json.dumps(data)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    global _cache
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache(
+                get_embedder(),
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+                max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            )
+        return _cache
@@ -0,0 +1,70 @@
+import asyncio
+import copy
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+
+class SingleFlight:
+    # Collapses concurrent calls that share a key into one execution: the first
+    # caller runs fn, the rest block on its result. Returns (result, shared). Every
+    # caller, the leader included, gets its own copy, so nobody mutates the shared one.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def join(self, key):
+        # Lower-level half of do() for results completed later (e.g. by a stream): returns
+        # (future, leader). The leader must call finish(); the others wait on the future.
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        return future, leader
+
+    def finish(self, key, future, result=None, error=None):
+        # Publishes the leader's outcome; only the first call for a future counts
+        with self._lock:
+            if future.done():
+                return
+            if self._calls.get(key) is future:
+                del self._calls[key]
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def do(self, key, fn, timeout=None):
+        # A follower waits at most `timeout` seconds for the leader, then runs fn itself
+        future, leader = self.join(key)
+        if not leader:
+            try:
+                return copy.deepcopy(future.result(timeout=timeout)), True
+            except FuturesTimeoutError:
+                return fn(), False
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return copy.deepcopy(result), False
+
+
+class AsyncSingleFlight:
+    # Event-loop flavour of SingleFlight; in-flight calls are tracked per loop
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        slot = (asyncio.get_running_loop(), key)
+        task = self._calls.get(slot)
+        if task is not None:
+            return copy.deepcopy(await asyncio.shield(task)), True
+        task = self._calls[slot] = asyncio.ensure_future(fn())
+        try:
+            return copy.deepcopy(await asyncio.shield(task)), False
+        finally:
+            if self._calls.get(slot) is task:
+                del self._calls[slot]
@@ -0,0 +1,41 @@
+import pytest
+
+from fingerprint import fingerprint, fingerprint_many
+
+
+@pytest.mark.parametrize("text", [
+    "Break on 15 Jan 2024",
+    "Break on 15-jan-24",
+    "Break on 15th January 2024",
+    "Break on Jan 15, 2024",
+    "Break on January 5 2024",
+    "Break on Sept. 3rd, 2024",
+    "Break on dec-31-2023",
+])
+def test_month_dates_are_masked(text):
+    assert fingerprint(text)[0] == "break on <date>"
+
+
+def test_month_does_not_leak_into_fingerprint():
+    assert fingerprint("NAV break on Jan 15, 2024")[1] == fingerprint("NAV break on Mar 3, 2025")[1]
+    assert fingerprint("NAV break on 15 Jan 2024")[1] == fingerprint("NAV break on Mar 3, 2025")[1]
+
+
+def test_month_like_words_are_not_dates():
+    assert fingerprint("market 12, 2024")[0] == "market <num>, <num>"
+    assert fingerprint("mayor 5 2024")[0] == "mayor <num> <num>"
+
+
+@pytest.mark.parametrize("amount", ["1,234", "-1,234", "+1,234", "-1,234,567", "(1,234)", "-1,234.50", "-12", "$-1,234"])
+def test_signed_and_separated_amounts(amount):
+    masked = fingerprint(f"cash break of {amount} usd")[0]
+    assert masked.replace("(<amount>)", "<amount>") == "cash break of <amount> usd"
+
+
+def test_ids_stay_ids():
+    assert fingerprint("trade T123456 for ISIN US0378331005")[0] == "trade <id> for isin <isin>"
+
+
+def test_batch_matches_single():
+    lines = ["Break on Jan 15, 2024 of -1,234", "Position break 15 Feb 2024 of +2,000.00"]
+    assert fingerprint_many(lines) == [fingerprint(line) for line in lines]
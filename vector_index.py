@@ -0,0 +1,355 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+# IVF trains its first coarse quantizer once this many vectors are stored and
+# retrains whenever the index has grown RETRAIN_GROWTH-fold since, so the
+# k-means cost stays amortised O(1) per insert. Training runs on a background
+# thread; until it finishes, searches use the previous centroids (or scan exactly)
+IVF_MIN_TRAIN = 4096
+IVF_RETRAIN_GROWTH = 4
+IVF_TRAIN_POINTS_PER_LIST = 32
+IVF_KMEANS_ITERATIONS = 8
+DEFAULT_NPROBE = 8
+_ASSIGN_BLOCK = 65536
+
+
+def _scores(matrix, vector):
+    # float16 stores are upcast a block at a time so no full-size copy is made
+    if matrix.dtype == np.float32:
+        return matrix @ vector
+    if not len(matrix):
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate([
+        matrix[i:i + _ASSIGN_BLOCK].astype(np.float32) @ vector
+        for i in range(0, len(matrix), _ASSIGN_BLOCK)
+    ])
+
+
+def _assign(centroids, vectors):
+    return np.concatenate([
+        np.argmax(np.asarray(vectors[i:i + _ASSIGN_BLOCK], dtype=np.float32) @ centroids.T, axis=1).astype(np.int32)
+        for i in range(0, len(vectors), _ASSIGN_BLOCK)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int32)
+
+
+class ExactIndex:
+    # Brute-force cosine search over unit vectors held in one preallocated float32
+    # matrix, grown by doubling so incremental inserts stay amortised O(1). With an
+    # EmbeddingStore the rows are instead read zero-copy from its memory map.
+    kind = "exact"
+
+    def __init__(self, dimensions, capacity=1024, store=None):
+        self.dimensions = dimensions
+        self.store = store
+        self._vectors = None if store is not None else np.zeros((capacity, dimensions), dtype=np.float32)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _matrix(self):
+        source = self._vectors if self.store is None else self.store.matrix()
+        return source[:self._size]
+
+    def row_scores(self, rows, vector):
+        # Scores only the given rows, gathered a block at a time so neither the
+        # in-memory matrix nor the shared store is copied whole
+        with self._lock:
+            matrix = self._matrix()
+        vector = np.asarray(vector, dtype=np.float32)
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate([
+            np.asarray(matrix[rows[i:i + _ASSIGN_BLOCK]], dtype=np.float32) @ vector
+            for i in range(0, len(rows), _ASSIGN_BLOCK)
+        ])
+
+    def sync(self):
+        # Picks up rows appended to the shared store by this or any other process
+        self.store.refresh()
+        with self._lock:
+            start, stop = self._size, len(self.store)
+            if stop > start:
+                self._size = stop
+                self._added(start, stop)
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        if self.store is not None:
+            self.store.append(vectors)
+            self.sync()
+            return
+        with self._lock:
+            start = self._size
+            needed = start + len(vectors)
+            if needed > len(self._vectors):
+                # Also how a read-only memory-mapped load gets its first writable copy
+                grown = np.zeros((max(needed, len(self._vectors) * 2), self.dimensions), dtype=np.float32)
+                grown[:start] = self._vectors[:start]
+                self._vectors = grown
+            self._vectors[start:needed] = vectors
+            self._size = needed
+            self._added(start, needed)
+
+    def _added(self, start, stop):
+        pass
+
+    def train(self):
+        pass
+
+    def candidates(self, vector):
+        # Returns (ids, scores) of every row the index considers for `vector`
+        with self._lock:
+            matrix = self._matrix()
+        return np.arange(len(matrix)), _scores(matrix, np.asarray(vector, dtype=np.float32))
+
+    def search(self, vector, k):
+        # Returns (ids, scores) of the k most similar rows, best first
+        ids, scores = self.candidates(vector)
+        if not len(scores):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return ids[best], scores[best]
+
+    def _arrays(self):
+        # Store-backed vectors are already on disk; only the index structure is saved
+        return {} if self.store is not None else {"vectors": self._vectors[:self._size]}
+
+    def save(self, path, **meta):
+        # Each save writes a new generation of .npy files and then swaps meta.json
+        # atomically, so readers never see a half-written index
+        os.makedirs(path, exist_ok=True)
+        generation = uuid.uuid4().hex[:12]
+        with self._lock:
+            files = {}
+            for name, array in self._arrays().items():
+                files[name] = f"{name}-{generation}.npy"
+                np.save(os.path.join(path, files[name]), array)
+            meta = dict(meta, kind=self.kind, dimensions=self.dimensions, size=self._size, files=files)
+        tmp = os.path.join(path, f"meta.json.{generation}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+        for name in os.listdir(path):
+            if name.endswith(".npy") and name not in files.values():
+                os.remove(os.path.join(path, name))
+
+    def _load(self, arrays, size):
+        if "vectors" in arrays:
+            self._vectors = arrays["vectors"]
+        self._size = size
+
+
+class IVFIndex(ExactIndex):
+    # Inverted-file ANN: vectors are bucketed by their nearest k-means centroid and a
+    # query scans only the nprobe closest buckets. Below IVF_MIN_TRAIN vectors it is exact.
+    kind = "ivf"
+
+    def __init__(self, dimensions, capacity=1024, store=None, nprobe=DEFAULT_NPROBE):
+        super().__init__(dimensions, capacity, store)
+        self.nprobe = nprobe
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._trained_size = 0
+        self._lists = []
+        self._pending = []
+        self._trainer = None
+
+    def _build_lists(self):
+        order = np.argsort(self._assignments, kind="stable")
+        bounds = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self._centroids))]
+        self._pending = [[] for _ in self._lists]
+
+    def _fit(self, vectors, size):
+        # Spherical k-means on a sample of the first `size` rows, then every one of them
+        # is assigned; reads only rows that already exist, so it needs no lock
+        nlist = max(1, int(math.sqrt(size)))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(
+            vectors[np.sort(rng.choice(size, min(size, nlist * IVF_TRAIN_POINTS_PER_LIST), replace=False))],
+            dtype=np.float32,
+        )
+        # Seeds are distinct rows: histories repeat patterns, and duplicate seeds leave
+        # lists empty that a query could then probe instead of the populated one
+        distinct = np.unique(sample, axis=0)
+        centroids = distinct[rng.choice(len(distinct), min(nlist, len(distinct)), replace=False)]
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable")
+            used, starts = np.unique(labels[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids = centroids.copy()
+            centroids[used] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        return centroids, _assign(centroids, vectors[:size])
+
+    def _retrain(self):
+        # Trains on a snapshot outside the lock; rows added meanwhile keep going to the
+        # old centroids and are reassigned to the new ones when they are swapped in
+        with self._lock:
+            vectors, size = self._matrix(), self._size
+        if not size:
+            return
+        centroids, assignments = self._fit(vectors, size)
+        with self._lock:
+            self._centroids = centroids
+            self._assignments = np.concatenate([assignments, _assign(centroids, self._matrix()[size:self._size])])
+            self._trained_size = size
+            self._build_lists()
+
+    def _train_in_background(self):
+        try:
+            while True:
+                self._retrain()
+                with self._lock:
+                    if not self._needs_training():
+                        self._trainer = None
+                        return
+        except BaseException:
+            with self._lock:
+                self._trainer = None
+            raise
+
+    def _needs_training(self):
+        return self._size >= max(IVF_MIN_TRAIN, self._trained_size * IVF_RETRAIN_GROWTH)
+
+    def wait(self):
+        # Blocks until a background retrain, if any, has been swapped in
+        trainer = self._trainer
+        if trainer is not None:
+            trainer.join()
+
+    def train(self):
+        self.wait()
+        self._retrain()
+
+    def _added(self, start, stop):
+        # Called under the lock on the request path, so k-means never runs here
+        if self._centroids is not None:
+            labels = _assign(self._centroids, self._matrix()[start:stop])
+            self._assignments = np.concatenate([self._assignments, labels])
+            for row, label in zip(range(start, stop), labels.tolist()):
+                self._pending[label].append(row)
+        if self._trainer is None and self._needs_training():
+            self._trainer = threading.Thread(target=self._train_in_background, name="ivf-train", daemon=True)
+            self._trainer.start()
+
+    def candidates(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self._centroids is None:
+                matrix = self._matrix()
+                return np.arange(len(matrix)), _scores(matrix, vector)
+            centroid_scores = self._centroids @ vector
+            nprobe = min(self.nprobe, len(centroid_scores))
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            for c in probes.tolist():
+                if self._pending[c]:
+                    self._lists[c] = np.concatenate([self._lists[c], self._pending[c]])
+                    self._pending[c] = []
+            ids = np.concatenate([self._lists[c] for c in probes.tolist()])
+            matrix = self._matrix()
+        return ids, np.asarray(matrix[ids], dtype=np.float32) @ vector
+
+    def _arrays(self):
+        arrays = super()._arrays()
+        if self._centroids is not None:
+            arrays.update(centroids=self._centroids, assignments=self._assignments[:self._size])
+        return arrays
+
+    def _load(self, arrays, size):
+        super()._load(arrays, size)
+        if "centroids" in arrays:
+            self._centroids = np.asarray(arrays["centroids"])
+            self._assignments = np.asarray(arrays["assignments"])
+            self._trained_size = self._size
+            self._build_lists()
+
+
+INDEX_KINDS = {"exact": ExactIndex, "ivf": IVFIndex}
+
+
+def make_index(kind, dimensions, store=None):
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown vector index {kind!r}; expected one of {', '.join(INDEX_KINDS)}")
+    return INDEX_KINDS[kind](dimensions, store=store)
+
+
+def load_index(path, store=None):
+    # Returns (index, meta). Arrays are memory-mapped read-only, so startup costs
+    # page faults rather than a full read; the first add copies them into memory.
+    # A store-backed index then syncs whatever the store gained since the save.
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    index = make_index(meta["kind"], meta["dimensions"], store)
+    index._load({
+        name: np.load(os.path.join(path, file), mmap_mode="r")
+        for name, file in meta["files"].items()
+    }, meta["size"])
+    if store is not None:
+        index.sync()
+    return index, meta
+
+
+def _clustered(rng, count, dimensions, clusters):
+    # Synthetic history: noisy copies of a few thousand exception "patterns"
+    centres = rng.standard_normal((clusters, dimensions), dtype=np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dimensions), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _latencies(index, queries, k):
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(index.search(query, k)[0])
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return results, timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark IVF recall and latency against exact search.")
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    vectors = _clustered(rng, args.count + args.queries, args.dimensions, args.clusters)
+    data, queries = vectors[:args.count], vectors[args.count:]
+
+    exact = ExactIndex(args.dimensions, capacity=args.count)
+    exact.add(data)
+    ivf = IVFIndex(args.dimensions, capacity=args.count)
+    started = time.perf_counter()
+    ivf.add(data)
+    ivf.wait()
+    print(f"ivf build: {time.perf_counter() - started:.1f}s, {len(ivf._lists)} lists")
+
+    truth, p50, p99 = _latencies(exact, queries, args.k)
+    print(f"exact      recall@{args.k}=1.000  p50={p50:.2f}ms  p99={p99:.2f}ms")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        found, p50, p99 = _latencies(ivf, queries, args.k)
+        recall = np.mean([len(np.intersect1d(a, b)) / len(a) for a, b in zip(truth, found)])
+        print(f"ivf np={nprobe:<3} recall@{args.k}={recall:.3f}  p50={p50:.2f}ms  p99={p99:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()